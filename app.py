@@ -1,17 +1,29 @@
 import os
 import base64
 import json
-from typing import List, Optional, TypedDict, Annotated, Sequence
+from typing import Dict, List, Optional, TypedDict, Annotated, Sequence
+from collections import OrderedDict
 import operator
+import math
+import threading
+import contextvars
+from contextlib import contextmanager, nullcontext
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
 import re
-import time # For SSE stream keep-alive (optional)
-import traceback # For detailed error logging
+import time # For SSE stream keep-alive
+import logging
+import functools
+import uuid
+import sqlite3
+import requests # Already a PyGithub dependency; used for streamed raw blob downloads
+import subprocess
+import tempfile
 
-from flask import Flask, request, render_template, flash, Response, stream_with_context
+from flask import Flask, request, render_template, flash, Response, stream_with_context, jsonify
 from dotenv import load_dotenv
 
 # --- GitHub Tool Imports ---
-from github import Github
+from github import Github, InputGitTreeElement
 from github.GithubException import (
     UnknownObjectException,
     BadCredentialsException,
@@ -19,158 +31,1325 @@ from github.GithubException import (
 )
 
 # --- LangChain/LangGraph Imports ---
-from langchain_core.messages import BaseMessage, HumanMessage, ToolMessage, AIMessage, SystemMessage
+from langchain_core.messages import BaseMessage, HumanMessage, ToolMessage, AIMessage, SystemMessage, message_chunk_to_message
 from langchain_core.tools import tool
+from pydantic import BaseModel, Field
 from langgraph.graph import StateGraph, END
 from langgraph.prebuilt import ToolExecutor
+from langgraph.checkpoint import base as checkpoint_base
+from langgraph.checkpoint.base import BaseCheckpointSaver, CheckpointTuple
+CHECKPOINT_WRITES_IDX_MAP = getattr(checkpoint_base, "WRITES_IDX_MAP", {}) # Fixed slots for special channels (errors, interrupts)
+
+# LangChain's Gemini wrapper (langchain_google_genai) is imported lazily in make_llm(); it is slow to import.
+# The imports above are not deferred: the @tool definitions, the checkpointer and the graph are module-level and need them.
+# Boot (import app, no warm-up) is ~1.5-2 s against ~0.2-0.3 s for bare Flask (about 7x), mostly langchain_core (~0.5 s) and PyGithub (~0.2 s);
+# benchmark.py reports it under "boot". Nothing at import touches the network or the persisted search index.
+
+# === 0. Logging, Metrics and Timing Spans ===
+logger = logging.getLogger("github_auto")
+
+class JsonLogFormatter(logging.Formatter):
+    """ One JSON object per line; values passed as `extra={"fields": {...}}` become top-level keys. """
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {"ts": round(record.created, 3), "level": record.levelname, "msg": record.getMessage(), "thread": record.threadName}
+        entry.update(getattr(record, "fields", None) or {})
+        if record.exc_info: entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+def configure_logging(level: str = "INFO", fmt: str = "text") -> None:
+    handler = logging.StreamHandler()
+    handler.setFormatter(JsonLogFormatter() if fmt == "json" else logging.Formatter("%(message)s"))
+    logger.handlers[:] = [handler]; logger.setLevel(level.upper()); logger.propagate = False
+
+
+class Metrics:
+    """ Minimal Prometheus text-format registry: labelled counters and histograms, plus gauges sampled at scrape time. """
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+    def __init__(self):
+        self._meta: Dict[str, tuple] = {} # name -> (type, help)
+        self._counters: Dict[tuple, float] = {} # (name, labels) -> value
+        self._histograms: Dict[tuple, list] = {} # (name, labels) -> bucket counts + [sum, count]
+        self._gauges: Dict[str, object] = {} # name -> fn() returning a number or {labels: number}
+        self._lock = threading.Lock()
+
+    def describe(self, name: str, kind: str, help_text: str) -> None: self._meta[name] = (kind, help_text)
+
+    def inc(self, metric: str, value: float = 1.0, **labels) -> None:
+        key = (metric, tuple(sorted(labels.items())))
+        with self._lock: self._counters[key] = self._counters.get(key, 0.0) + value
+
+    def observe(self, metric: str, value: float, **labels) -> None:
+        key = (metric, tuple(sorted(labels.items())))
+        with self._lock:
+            hist = self._histograms.setdefault(key, [0] * len(self.BUCKETS) + [0.0, 0])
+            for i, bound in enumerate(self.BUCKETS):
+                if value <= bound: hist[i] += 1
+            hist[-2] += value; hist[-1] += 1
+
+    def gauge(self, name: str, help_text: str, fn) -> None:
+        self.describe(name, "gauge", help_text); self._gauges[name] = fn
+
+    @staticmethod
+    def _labels(labels, extra: tuple = ()) -> str:
+        pairs = list(labels) + list(extra)
+        if not pairs: return ""
+        escape = lambda v: str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        return "{" + ",".join(f'{k}="{escape(v)}"' for k, v in pairs) + "}"
+
+    def render(self) -> str:
+        lines = []; emitted = set()
+        def header(name):
+            if name in emitted: return
+            emitted.add(name); kind, help_text = self._meta.get(name, ("untyped", ""))
+            lines.extend([f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"])
+        with self._lock: counters = dict(self._counters); histograms = {k: list(v) for k, v in self._histograms.items()}
+        for (name, labels), value in sorted(counters.items()): header(name); lines.append(f"{name}{self._labels(labels)} {value}")
+        for (name, labels), hist in sorted(histograms.items()):
+            header(name)
+            for bound, count in zip(self.BUCKETS, hist): lines.append(f"{name}_bucket{self._labels(labels, (('le', bound),))} {count}")
+            lines.append(f"{name}_bucket{self._labels(labels, (('le', '+Inf'),))} {hist[-1]}")
+            lines.append(f"{name}_sum{self._labels(labels)} {round(hist[-2], 6)}"); lines.append(f"{name}_count{self._labels(labels)} {hist[-1]}")
+        for name, fn in self._gauges.items():
+            try: value = fn()
+            except Exception as e: logger.warning(f"Warn: gauge {name} failed: {e}"); continue
+            header(name)
+            for labels, v in (value.items() if isinstance(value, dict) else [((), value)]): lines.append(f"{name}{self._labels(labels)} {v}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+metrics.describe("github_auto_span_seconds", "histogram", "Duration of graph nodes, LLM calls, tool calls and GitHub API calls.")
+metrics.describe("github_auto_llm_tokens_total", "counter", "LLM tokens by type (prompt/completion).")
+metrics.describe("github_auto_tool_calls_total", "counter", "Tool calls by tool and status.")
+metrics.describe("github_auto_github_requests_total", "counter", "GitHub API requests by endpoint and status.")
+metrics.describe("github_auto_runs_total", "counter", "Agent runs by outcome.")
+
+
+class RunTimings:
+    """ Per-run breakdown of span time by kind and name, attached to the SSE 'complete' event. """
+    def __init__(self):
+        self.started = time.perf_counter(); self._totals: Dict[tuple, list] = {}; self._lock = threading.Lock()
+
+    def add(self, kind: str, name: str, seconds: float) -> None:
+        with self._lock: total = self._totals.setdefault((kind, name), [0, 0.0]); total[0] += 1; total[1] += seconds
+
+    def summary(self) -> dict:
+        spans: Dict[str, dict] = {}
+        with self._lock:
+            for (kind, name), (count, seconds) in sorted(self._totals.items()): spans.setdefault(kind, {})[name] = {"count": count, "seconds": round(seconds, 3)}
+        return {"total_seconds": round(time.perf_counter() - self.started, 3), "spans": spans}
+
+
+_run_timings: contextvars.ContextVar = contextvars.ContextVar("run_timings", default=None)
+
+def record_span(kind: str, name: str, seconds: float, **fields) -> None:
+    """ Feeds one finished span to the latency histogram, the current run's breakdown and the debug log. """
+    metrics.observe("github_auto_span_seconds", seconds, kind=kind, name=name)
+    timings = _run_timings.get()
+    if timings is not None: timings.add(kind, name, seconds)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"span {kind}:{name} {seconds * 1000:.1f}ms", extra={"fields": dict(span_kind=kind, span_name=name, duration_ms=round(seconds * 1000, 1), **fields)})
+
+@contextmanager
+def span(kind: str, name: str, **fields):
+    """ Times a block; the yielded dict can be filled with extra fields for the span log line. """
+    started = time.perf_counter()
+    try: yield fields
+    finally: record_span(kind, name, time.perf_counter() - started, **fields)
+
+def traced(kind: str, name: str):
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(kind, name): return fn(*args, **kwargs)
+        return wrapper
+    return decorator
 
-# Use LangChain's wrapper for Gemini
-from langchain_google_genai import ChatGoogleGenerativeAI
 
 # === 1. GitHub Tool Class (Keep your existing, correct class here) ===
+class GithubTransport:
+    """ Shared GitHub client: pooled keep-alive connections, jittered retries on 403/429/5xx, ETag conditional GETs,
+        and, once the remaining rate-limit budget drops below `pace_below`, a token bucket that spreads what is left above
+        `rate_reserve` until the reset. Tracks per-endpoint counts and latency. """
+    def __init__(self, token: str, timeout: int = 30, pool_size: int = 10, max_retries: int = 5, rate_reserve: int = 100, burst: int = 10, max_concurrency: int = 8,
+                 max_rate_wait: float = 30, github=None, pace_below: int = 1000):
+        self.rate_reserve = rate_reserve; self.burst = burst; self.pace_below = max(pace_below, rate_reserve)
+        self._slots = threading.BoundedSemaphore(max_concurrency) # Calls in flight across all sessions
+        self.github = github or Github(token, timeout=timeout, retry=self._make_retry(max_retries, max_rate_wait), pool_size=pool_size) # `github` injects a client (tests, benchmark)
+        self.timeout = timeout
+        self.session = requests.Session() # Raw (non-JSON) downloads, streamed in chunks
+        self.session.headers["Authorization"] = f"token {token}"
+        self.session.mount("https://", requests.adapters.HTTPAdapter(pool_maxsize=pool_size, max_retries=self._make_retry(max_retries, max_rate_wait)))
+        self._etags: Dict[str, tuple] = {} # url -> (etag, json body)
+        self._tokens = float(burst); self._last_refill = time.monotonic()
+        self._stats: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _make_retry(max_retries: int, max_rate_wait: float):
+        """ Retries with jitter, but never sleeps longer than max_rate_wait for a rate-limit reset (the caller holds a
+            concurrency slot meanwhile): a longer wait raises RateLimitExceededExceedsMaxWait, which tools report as ERR. """
+        try: from github import GithubRetry # Understands GitHub's primary/secondary rate-limit 403s (PyGithub >= 2.0)
+        except ImportError: from urllib3.util.retry import Retry as GithubRetry
+        options = dict(total=max_retries, backoff_factor=1.0, status_forcelist=[403, 429, 500, 502, 503, 504], respect_retry_after_header=True) # A list: GithubRetry appends to it
+        capped = dict(options, secondary_rate_wait=min(60, max_rate_wait), max_rate_limit_wait=max_rate_wait)
+        uncapped = dict(options, respect_retry_after_header=False) # No wait cap (older PyGithub / plain urllib3): back off instead of sleeping until reset
+        for candidate in (dict(capped, backoff_jitter=1.0), capped, dict(uncapped, backoff_jitter=1.0)):
+            try: return GithubRetry(**candidate)
+            except TypeError: continue
+        return GithubRetry(**uncapped) # urllib3 < 2 has no backoff_jitter
+
+    def _refill_rate(self) -> Optional[float]:
+        """ Requests/second we can afford: the budget left above the reserve, spread evenly until the reset.
+            None = unthrottled (no rate headers seen yet, or the budget is still above the pace_below low-water mark). """
+        requester = getattr(self.github, "requester", None)
+        remaining, limit = getattr(requester, "rate_limiting", (-1, -1))
+        reset_at = getattr(requester, "rate_limiting_resettime", 0)
+        if remaining < 0 or limit < 0 or not reset_at or remaining >= self.pace_below: return None
+        return max(remaining - self.rate_reserve, 0) / max(reset_at - time.time(), 1.0) or 0.05
+
+    def _throttle(self) -> bool:
+        """ Waits for a token while pacing; returns whether one was taken (see _refund). """
+        while True:
+            with self._lock:
+                rate = self._refill_rate(); now = time.monotonic()
+                if rate is None: self._tokens = float(self.burst); self._last_refill = now; return False
+                self._tokens = min(self.burst, self._tokens + (now - self._last_refill) * rate); self._last_refill = now
+                if self._tokens >= 1: self._tokens -= 1; return True
+                wait = min((1 - self._tokens) / rate, 30.0)
+            logger.info(f"  GitHub budget low, pacing requests ({wait:.1f}s)..."); time.sleep(wait)
+
+    def _refund(self) -> None:
+        """ Gives back the token of a request GitHub did not count (a 304). """
+        with self._lock: self._tokens = min(self.burst, self._tokens + 1)
+
+    def _record(self, endpoint: str, started: float, error: bool = False, not_modified: bool = False) -> None:
+        elapsed = time.perf_counter() - started; elapsed_ms = elapsed * 1000
+        record_span("github", endpoint, elapsed)
+        metrics.inc("github_auto_github_requests_total", endpoint=endpoint, status="error" if error else "not_modified" if not_modified else "ok")
+        with self._lock:
+            stat = self._stats.setdefault(endpoint, {"calls": 0, "errors": 0, "not_modified": 0, "total_ms": 0.0, "max_ms": 0.0})
+            stat["calls"] += 1; stat["errors"] += error; stat["not_modified"] += not_modified
+            stat["total_ms"] += elapsed_ms; stat["max_ms"] = max(stat["max_ms"], elapsed_ms)
+
+    def call(self, endpoint: str, fn, *args, **kwargs):
+        """ Runs one PyGithub call through the rate-limit scheduler and records it under `endpoint`. """
+        self._throttle()
+        with self._slots:
+            started = time.perf_counter()
+            try: result = fn(*args, **kwargs)
+            except Exception: self._record(endpoint, started, error=True); raise
+        self._record(endpoint, started); return result
+
+    def conditional_get(self, endpoint: str, requester, url: str):
+        """ GET with If-None-Match; a 304 (which GitHub does not count against the rate limit) returns the cached body. """
+        charged = self._throttle()
+        cached = self._etags.get(url)
+        with self._slots:
+            started = time.perf_counter()
+            try: headers, data = requester.requestJsonAndCheck("GET", url, headers={"If-None-Match": cached[0]} if cached else None)
+            except Exception: self._record(endpoint, started, error=True); raise
+        if cached and not data:
+            if charged: self._refund()
+            self._record(endpoint, started, not_modified=True); return cached[1]
+        if headers.get("etag"): self._etags[url] = (headers["etag"], data)
+        self._record(endpoint, started); return data
+
+    def stream(self, endpoint: str, url: str, max_bytes: int, stop_bytes: Optional[int] = None, stop_lines: Optional[int] = None,
+               accept: str = "application/vnd.github.raw") -> tuple:
+        """ Chunked raw GET; returns (body, complete). Stops early once stop_bytes bytes or stop_lines newlines have arrived,
+            and raises ValueError as soon as the body passes max_bytes instead of buffering it. """
+        self._throttle()
+        with self._slots:
+            started = time.perf_counter(); body = bytearray(); newlines = 0; complete = True
+            try:
+                with self.session.get(url, headers={"Accept": accept}, stream=True, timeout=self.timeout) as resp:
+                    resp.raise_for_status()
+                    for chunk in resp.iter_content(64 * 1024):
+                        body += chunk; newlines += chunk.count(b"\n")
+                        if (stop_bytes is not None and len(body) >= stop_bytes) or (stop_lines is not None and newlines >= stop_lines): complete = False; break
+                        if len(body) > max_bytes: raise ValueError(f"Blob exceeds the {max_bytes} byte read limit.")
+            except Exception: self._record(endpoint, started, error=True); raise
+        self._record(endpoint, started); return bytes(body), complete
+
+    def stats(self) -> dict:
+        requester = getattr(self.github, "requester", None)
+        remaining, limit = getattr(requester, "rate_limiting", (-1, -1))
+        with self._lock:
+            endpoints = {name: dict(stat, avg_ms=round(stat["total_ms"] / stat["calls"], 1) if stat["calls"] else 0.0) for name, stat in self._stats.items()}
+        return {"rate_limit": {"remaining": remaining, "limit": limit, "reserve": self.rate_reserve}, "endpoints": endpoints}
+
+
+class ContentCache:
+    """ Decoded file contents keyed by (path, blob SHA), evicted least-recently-used once the byte budget is exceeded. """
+    def __init__(self, max_bytes: int = 8 * 1024 * 1024):
+        self.max_bytes = max_bytes; self.bytes_used = 0
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict() # path -> (sha, content, size)
+        self.hits = 0; self.misses = 0; self.evictions = 0
+        self._lock = threading.Lock()
+
+    def get(self, path: str, sha: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is None or entry[0] != sha: self.misses += 1; return None
+            self._entries.move_to_end(path); self.hits += 1; return entry[1]
+
+    def put(self, path: str, sha: str, content: str) -> None:
+        size = len(content.encode("utf-8"))
+        with self._lock:
+            old = self._entries.pop(path, None)
+            if old: self.bytes_used -= old[2]
+            if size > self.max_bytes: return # Never cache a single entry larger than the whole budget
+            self._entries[path] = (sha, content, size); self.bytes_used += size
+            while self.bytes_used > self.max_bytes:
+                _, (_, _, evicted_size) = self._entries.popitem(last=False)
+                self.bytes_used -= evicted_size; self.evictions += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                    "entries": len(self._entries), "bytes_used": self.bytes_used, "max_bytes": self.max_bytes}
+
+
+class WriteSession:
+    """ Writes buffered during one agent run, published together as a single commit. """
+    def __init__(self):
+        self.pending: "OrderedDict[str, str]" = OrderedDict() # path -> full new content
+        self.base_shas: Dict[str, Optional[str]] = {} # path -> blob SHA the edit was based on (None = new file)
+        self.messages: List[str] = []
+        self.closed = False # Set once the run starts committing; later (e.g. timed-out) writes are refused
+        self._lock = threading.Lock() # Tool calls for different paths stage concurrently
+
+    def stage(self, path: str, content: str, commit_message: str, base_sha: Optional[str]) -> None:
+        with self._lock:
+            if self.closed: raise RuntimeError("This run's changes were already committed; the write was not applied.")
+            if path not in self.pending: self.base_shas[path] = base_sha
+            self.pending[path] = content
+            if commit_message not in self.messages: self.messages.append(commit_message)
+
+    def close(self) -> None:
+        with self._lock: self.closed = True
+
+    def commit_message(self) -> str:
+        if len(self.messages) == 1: return self.messages[0]
+        summary = f"Update {len(self.pending)} files" if len(self.pending) > 1 else self.messages[0]
+        return summary + "\n\n" + "\n".join(f"- {m}" for m in self.messages)
+
+
+_active_write_session: contextvars.ContextVar = contextvars.ContextVar("active_write_session", default=None)
+
+
+class ToolCallGuard:
+    """ Decides a race between a write running on the tool pool and the caller timing it out: whichever of claim()
+        (the write is about to be applied) and abandon() (the caller gave up) comes first wins. """
+    def __init__(self):
+        self.claimed = False; self.abandoned = False; self._lock = threading.Lock()
+
+    def claim(self) -> bool:
+        with self._lock:
+            if not self.abandoned: self.claimed = True
+            return self.claimed
+
+    def abandon(self) -> bool:
+        with self._lock:
+            if not self.claimed: self.abandoned = True
+            return self.abandoned
+
+
+# Set per write tool call by call_tool; checked by Github_Auto right before a write is staged or committed
+_tool_call_guard: contextvars.ContextVar = contextvars.ContextVar("tool_call_guard", default=None)
+
+
+def _split_lines(text: str) -> List[list]:
+    """ [[line, terminator], ...] split on CRLF, LF and CR only (str.splitlines also splits on \\f, \\x85, \\u2028 ...); the last terminator may be "". """
+    parts = re.split(r"(\r\n|\n|\r)", text)
+    lines = [[parts[n], parts[n + 1]] for n in range(0, len(parts) - 1, 2)]
+    if parts[-1]: lines.append([parts[-1], ""])
+    return lines
+
+
 class Github_Auto:
     # (Paste the full Github_Auto class code here)
     """ Manages interactions with a specific GitHub repository. """
-    def __init__(self, token: str, repo_name: str, branch: str = "main"):
-        self.token = token; self.repo_name = repo_name; self.branch = branch
-        self.github_instance: Optional[Github] = None; self.repo = None
+    TREE_CACHE_SIZE = 4 # Recursive tree listings kept in memory, keyed by head commit SHA
+    SESSION_COMMIT_ATTEMPTS = 3 # Rebase-and-retry budget when the branch moves under a session commit
+    LARGE_BLOB_BYTES = 1024 * 1024 # From this size blobs are streamed raw instead of base64 JSON (the contents API returns no content above 1 MB)
+
+    def __init__(self, token: str, repo_name: str, branch: str = "main", content_cache_bytes: int = 8 * 1024 * 1024, transport: Optional[GithubTransport] = None,
+                 max_blob_bytes: int = 20 * 1024 * 1024):
+        self._init_state(repo_name, branch, content_cache_bytes, max_blob_bytes); self.token = token; self.transport = transport
         if not token: raise ValueError("GitHub token required.")
         if not repo_name: raise ValueError("Repo name required.")
         try:
-            print("Auth GitHub..."); self.github_instance = Github(self.token, timeout=30)
-            user = self.github_instance.get_user(); print(f"Auth OK: {user.login}")
-            print(f"Accessing repo: {self.repo_name}"); self.repo = self.github_instance.get_repo(self.repo_name)
-            print(f"Accessed '{self.repo.full_name}', branch '{self.branch}'")
-            try: self.repo.get_branch(self.branch); print("Target branch confirmed.")
-            except UnknownObjectException: print(f"WARN: Target branch '{self.branch}' nonexistent.")
-        except BadCredentialsException: print("ERR: Invalid GitHub token."); raise
-        except UnknownObjectException: print(f"ERR: Repo '{self.repo_name}' not found/access denied."); raise
-        except GithubException as e: print(f"ERR: GitHub API: {e}"); raise
-        except Exception as e: print(f"ERR: Init: {e}"); raise
-
-    def list_repository_files(self, directory_path: str = "") -> List[str]:
-        if not self.repo: return ["Error: Repo object uninitialized."]
-        print(f"\nTOOL: List files: '{directory_path or '/'}'..."); all_files = []
+            logger.debug("Auth GitHub..."); self.transport = self.transport or GithubTransport(self.token); self.github_instance = self.transport.github
+            login = self.transport.call("user", lambda: self.github_instance.get_user().login); logger.info(f"Auth OK: {login}")
+            logger.debug(f"Accessing repo: {self.repo_name}"); self.repo = self.transport.call("repo", self.github_instance.get_repo, self.repo_name)
+            logger.debug(f"Accessed '{self.repo.full_name}', branch '{self.branch}'")
+            try: self.transport.call("branch", self.repo.get_branch, self.branch); logger.debug("Target branch confirmed.")
+            except UnknownObjectException: logger.warning(f"WARN: Target branch '{self.branch}' nonexistent.")
+            self.ready = True
+        except BadCredentialsException: logger.error("ERR: Invalid GitHub token."); raise
+        except UnknownObjectException: logger.error(f"ERR: Repo '{self.repo_name}' not found/access denied."); raise
+        except GithubException as e: logger.error(f"ERR: GitHub API: {e}"); raise
+        except Exception as e: logger.error(f"ERR: Init: {e}"); raise
+
+    def _init_state(self, repo_name: str, branch: str, content_cache_bytes: int, max_blob_bytes: int) -> None:
+        """ Fields every backend shares; a backend sets `ready` once it can serve reads and writes. """
+        self.repo_name = repo_name; self.branch = branch; self.max_blob_bytes = max_blob_bytes; self.ready = False
+        self.token: Optional[str] = None; self.github_instance: Optional[Github] = None; self.repo = None; self.transport: Optional[GithubTransport] = None
+        self._init_caches(content_cache_bytes)
+
+    def _init_caches(self, content_cache_bytes: int) -> None:
+        self.content_cache = ContentCache(content_cache_bytes)
+        self._tree_cache: "OrderedDict[str, Dict[str, dict]]" = OrderedDict()
+        self._tree_lock = threading.Lock() # Guards _tree_cache; concurrent tool calls share this instance
+        self.head_sha: Optional[str] = None; self.tree_sha: Optional[str] = None; self.tree_truncated = False
+
+    def _head_commit_sha(self) -> str:
+        """ One cheap (conditional) ref lookup; the listing cache is keyed by the commit it returns. """
+        ref = self.transport.conditional_get("git_ref", self.repo._requester, f"{self.repo.url}/git/ref/heads/{self.branch}")
+        return ref["object"]["sha"]
+
+    def get_tree_index(self, head_sha: Optional[str] = None) -> Dict[str, dict]:
+        """ Returns {path: {"path", "size", "sha"}} for every blob on the branch head, fetched with one recursive tree call. """
+        head_sha = head_sha or self._head_commit_sha()
+        with self._tree_lock:
+            cached = self._tree_cache.get(head_sha)
+            if cached is not None: self._tree_cache.move_to_end(head_sha)
+        if cached is not None: logger.debug(f"Tree cache hit @ {head_sha[:7]}."); return cached
+        tree_sha, index = self._fetch_tree(head_sha)
+        with self._tree_lock:
+            self._tree_cache[head_sha] = index; self.head_sha = head_sha; self.tree_sha = tree_sha
+            while len(self._tree_cache) > self.TREE_CACHE_SIZE: self._tree_cache.popitem(last=False)
+        logger.info(f"Tree fetched @ {head_sha[:7]} (tree {tree_sha[:7]}): {len(index)} blobs.")
+        return index
+
+    def _fetch_tree(self, head_sha: str) -> tuple:
+        """ (tree_sha, {path: entry}) for a commit, via one recursive Git Trees call. """
+        tree_sha = self.transport.call("git_commit", lambda: self.repo.get_git_commit(head_sha).tree.sha)
+        tree = self.transport.call("git_tree", self.repo.get_git_tree, tree_sha, recursive=True)
+        self.tree_truncated = bool(tree.raw_data.get("truncated"))
+        if self.tree_truncated: logger.warning(f"  Warn: Tree {tree_sha[:7]} truncated by GitHub; listing is partial.")
+        return tree_sha, {e.path: {"path": e.path, "size": e.size, "sha": e.sha} for e in tree.tree if e.type == "blob"}
+
+    def _record_commit(self, parent_sha: Optional[str], commit_sha: str, files: Dict[str, tuple]) -> None:
+        """ Folds one of our own commits ({path: (blob_sha, content)}) into the tree and content caches so written files never have to be re-read. """
+        for path, (blob_sha, content) in files.items(): self.content_cache.put(path, blob_sha, content)
+        with self._tree_lock:
+            parent_index = self._tree_cache.get(parent_sha) if parent_sha else None
+            if parent_index is None: return # Unknown parent (concurrent push?): the next ref lookup refetches the tree
+            index = dict(parent_index)
+            for path, (blob_sha, content) in files.items(): index[path] = {"path": path, "size": len(content.encode("utf-8")), "sha": blob_sha}
+            self._tree_cache[commit_sha] = index; self.head_sha = commit_sha
+            while len(self._tree_cache) > self.TREE_CACHE_SIZE: self._tree_cache.popitem(last=False)
+
+    def read_blob(self, path: str, sha: str) -> str:
+        """ Decoded content of a known blob, served from the content cache when possible. Raises on API errors. """
+        content = self.content_cache.get(path, sha)
+        return content if content is not None else self._fetch_blob(path, sha)
+
+    def _fetch_blob(self, path: str, sha: str, size: Optional[int] = None) -> str:
+        """ Whole blob, decoded and cached. Blobs of LARGE_BLOB_BYTES or more are streamed; max_blob_bytes is a hard limit. """
+        if size is not None and size > self.max_blob_bytes: raise ValueError(f"'{path}' is {size} bytes, over the {self.max_blob_bytes} byte read limit.")
+        if size is not None and size >= self.LARGE_BLOB_BYTES: content = self._stream_blob(sha)[0].decode("utf-8")
+        else:
+            blob = self.transport.call("git_blob", self.repo.get_git_blob, sha)
+            content = base64.b64decode(blob.content).decode('utf-8') if blob.content else ""
+        self.content_cache.put(path, sha, content); return content
+
+    def _stream_blob(self, sha: str, stop_bytes: Optional[int] = None, stop_lines: Optional[int] = None) -> tuple:
+        """ (raw bytes, complete) from the raw blob endpoint, optionally stopping once the requested prefix has arrived. """
+        return self.transport.stream("git_blob_raw", f"{self.repo.url}/git/blobs/{sha}", self.max_blob_bytes, stop_bytes=stop_bytes, stop_lines=stop_lines)
+
+    def known_sha(self, path: str) -> Optional[str]:
+        """ Blob SHA of a path in the most recently seen head tree, without any API call. """
+        with self._tree_lock: index = self._tree_cache.get(self.head_sha) if self.head_sha else None
+        entry = index.get(path) if index else None
+        return entry["sha"] if entry else None
+
+    def list_repository_files(self, directory_path: str = "") -> List[dict]:
+        if not self.ready: return ["Error: Repo object uninitialized."]
+        logger.info(f"TOOL: List files: '{directory_path or '/'}'...")
+        prefix = directory_path.strip("/")
         try:
-            contents = self.repo.get_contents(directory_path, ref=self.branch); content_stack = list(contents)
-            while content_stack:
-                item = content_stack.pop()
-                if item.type == "dir":
-                    try: content_stack.extend(self.repo.get_contents(item.path, ref=self.branch))
-                    except Exception as e: print(f"  Warn: Cannot list '{item.path}': {e}")
-                else: all_files.append(item.path)
-            print(f"Found {len(all_files)} items in '{directory_path or '/'}'.")
+            index = self.get_tree_index(); session = _active_write_session.get()
+            if session and session.pending:
+                index = dict(index)
+                for path, content in session.pending.items(): index[path] = {"path": path, "size": len(content.encode("utf-8")), "sha": None} # Staged, not yet committed
+            if not prefix: all_files = list(index.values())
+            elif prefix in index: all_files = [index[prefix]]
+            else: all_files = [entry for path, entry in index.items() if path.startswith(prefix + "/")]
+            if prefix and not all_files: msg = f"ERR: Dir not found: '{directory_path}'."; logger.warning(msg); return [msg]
+            all_files.sort(key=lambda entry: entry["path"])
+            logger.debug(f"Found {len(all_files)} items in '{directory_path or '/'}'.")
             return all_files if all_files else ["No files found."]
-        except UnknownObjectException: msg = f"ERR: Dir not found: '{directory_path}'."; print(msg); return [msg]
-        except GithubException as e: msg = f"ERR: List files: {e}"; print(msg); return [msg]
-        except Exception as e: msg = f"ERR: Unexpected list error: {e}"; print(msg); return [msg]
+        except UnknownObjectException: msg = f"ERR: Branch not found: '{self.branch}'."; logger.warning(msg); return [msg]
+        except GithubException as e: msg = f"ERR: List files: {e}"; logger.warning(msg); return [msg]
+        except Exception as e: msg = f"ERR: Unexpected list error: {e}"; logger.warning(msg); return [msg]
 
     def get_file_content(self, file_path: str) -> str:
-        if not self.repo: return "Error: Repo object uninitialized."
-        print(f"\nTOOL: Read file: {file_path}...");
+        if not self.ready: return "Error: Repo object uninitialized."
+        logger.info(f"TOOL: Read file: {file_path}...");
+        session = _active_write_session.get()
+        if session and file_path in session.pending: logger.debug("Success read (staged in this run)."); return session.pending[file_path]
+        try:
+            index = self.get_tree_index(); entry = index.get(file_path)
+            if entry is None and not self.tree_truncated:
+                if any(path.startswith(file_path.rstrip("/") + "/") for path in index): msg = f"ERR: Path is dir: '{file_path}'."; logger.warning(msg); return msg
+                raise UnknownObjectException(404, {"message": "Not Found"}, None)
+            if entry is not None:
+                content = self.content_cache.get(file_path, entry["sha"])
+                if content is not None: logger.debug(f"Success read (cache hit @ {entry['sha'][:7]})."); return content
+                content = self._fetch_blob(file_path, entry["sha"], entry["size"])
+                logger.debug("Success read." if content else "File empty."); return content
+            item = self.transport.call("contents", self.repo.get_contents, file_path, ref=self.branch) # Truncated tree: fall back to the contents API
+            if isinstance(item, list): msg = f"ERR: Path is dir: '{file_path}'."; logger.warning(msg); return msg
+            if item.type != 'file': msg = f"ERR: Path not file: '{file_path}'."; logger.warning(msg); return msg
+            if item.content: content = base64.b64decode(item.content).decode('utf-8'); self.content_cache.put(file_path, item.sha, content); logger.debug("Success read."); return content
+            if item.size: return self._fetch_blob(file_path, item.sha, item.size) # Over 1 MB the contents API omits the content
+            logger.info("File empty."); return ""
+        except UnknownObjectException: msg = f"Error: File not found at '{file_path}' on branch '{self.branch}'."; logger.warning(msg); return msg # Exact error match
+        except GithubException as e: msg = f"ERR: Read file GH: {e}"; logger.warning(msg); return msg
+        except ValueError as e: msg = f"ERR: {e} Read it by byte range with read_github_file_range(unit='bytes')."; logger.warning(msg); return msg
+        except Exception as e: msg = f"ERR: Unexpected read error: {e}"; logger.warning(msg); return msg
+
+    def _read_text(self, file_path: str, stop_bytes: Optional[int] = None, stop_lines: Optional[int] = None) -> tuple:
+        """ (text, complete) for a file. An uncached large blob is streamed only until stop_bytes/stop_lines are covered
+            (ValueError if that needs more than max_blob_bytes). Raises LookupError carrying the tool-facing error message. """
+        session = _active_write_session.get()
+        if session and file_path in session.pending: return session.pending[file_path], True
+        entry = self.get_tree_index().get(file_path)
+        if entry is not None:
+            content = self.content_cache.get(file_path, entry["sha"])
+            if content is not None: return content, True
+            if entry["size"] >= self.LARGE_BLOB_BYTES and (stop_bytes is not None or stop_lines is not None):
+                data, complete = self._stream_blob(entry["sha"], stop_bytes, stop_lines)
+                if complete: text = data.decode("utf-8"); self.content_cache.put(file_path, entry["sha"], text); return text, True
+                return data.decode("utf-8", errors="ignore"), False # A cut may split a multi-byte character
+        content = self.get_file_content(file_path) # Small blobs, truncated trees, and the exact not-found/directory messages
+        if content.startswith("Error:") or content.startswith("ERR"): raise LookupError(content)
+        return content, True
+
+    @staticmethod
+    def _outline(lines: List[str]) -> List[dict]:
+        """ Markdown (ATX) and HTML <h1>-<h6> headings as {line, level, title}; fenced code blocks are skipped. """
+        headings = []; fenced = False
+        for number, line in enumerate(lines, 1):
+            stripped = line.strip()
+            if stripped.startswith("```") or stripped.startswith("~~~"): fenced = not fenced; continue
+            if fenced: continue
+            match = re.match(r"(#{1,6})\s+(.+?)\s*#*\s*$", stripped)
+            if match: headings.append({"line": number, "level": len(match.group(1)), "title": match.group(2)}); continue
+            for match in re.finditer(r"<h([1-6])\b[^>]*>(.*?)</h\1\s*>", line, re.IGNORECASE):
+                title = re.sub(r"<[^>]+>", "", match.group(2)).strip()
+                if title: headings.append({"line": number, "level": int(match.group(1)), "title": title})
+        return headings
+
+    def get_file_outline(self, file_path: str) -> dict:
+        """ Size, line count and heading list of a file, so the agent can request only the section it needs. """
+        logger.info(f"TOOL: Outline file: {file_path}...")
+        try: content, _ = self._read_text(file_path)
+        except LookupError as e: return {"error": str(e)}
+        except Exception as e: msg = f"ERR: Outline: {e}"; logger.warning(msg); return {"error": msg}
+        lines = content.splitlines()
+        return {"path": file_path, "bytes": len(content.encode("utf-8")), "lines": len(lines), "headings": self._outline(lines)}
+
+    def read_file_range(self, file_path: str, start: Optional[int] = None, end: Optional[int] = None, unit: str = "lines",
+                        heading: Optional[str] = None, max_chars: Optional[int] = None) -> str:
+        """ One slice of a file: lines start..end (1-based, inclusive), bytes start..end (0-based, end exclusive), or the
+            section under a heading (up to the next heading of the same or a higher level). Prefixed with a one-line locator. """
+        logger.info(f"TOOL: Read range: {file_path} {f'heading {heading!r}' if heading else f'{unit} {start}-{end}'}...")
+        if unit not in ("lines", "bytes"): return "ERR range: unit must be 'lines' or 'bytes'."
+        if start is not None and end is not None and end < start: return f"ERR range: end ({end}) is before start ({start})."
         try:
-            item = self.repo.get_contents(file_path, ref=self.branch)
-            if isinstance(item, list): msg = f"ERR: Path is dir: '{file_path}'."; print(msg); return msg
-            if item.type != 'file': msg = f"ERR: Path not file: '{file_path}'."; print(msg); return msg
-            if item.content: content = base64.b64decode(item.content).decode('utf-8'); print("Success read."); return content
-            else: print("File empty."); return ""
-        except UnknownObjectException: msg = f"Error: File not found at '{file_path}' on branch '{self.branch}'."; print(msg); return msg # Exact error match
-        except GithubException as e: msg = f"ERR: Read file GH: {e}"; print(msg); return msg
-        except Exception as e: msg = f"ERR: Unexpected read error: {e}"; print(msg); return msg
+            if heading:
+                lines = self._read_text(file_path)[0].splitlines(); headings = self._outline(lines); wanted = heading.strip().lstrip("#").strip().lower()
+                target = next((h for h in headings if h["title"].lower() == wanted), None) or next((h for h in headings if wanted in h["title"].lower()), None)
+                if target is None: return f"ERR range: Heading '{heading}' not found in '{file_path}'. Headings: " + "; ".join(h["title"] for h in headings[:50])
+                following = next((h["line"] for h in headings if h["line"] > target["line"] and h["level"] <= target["level"]), len(lines) + 1)
+                first, last = target["line"], following - 1; total = len(lines); text = "\n".join(lines[first - 1:last])
+                locator = f"[{file_path} section '{target['title']}', lines {first}-{last} of {total}]"
+            elif unit == "bytes":
+                # No end: read one result's worth, so an open-ended read of a file over the blob limit still returns its start
+                first = max(start or 0, 0); stop = end if end is not None else first + (max_chars or self.max_blob_bytes)
+                content, complete = self._read_text(file_path, stop_bytes=stop)
+                data = content.encode("utf-8"); last = min(stop, len(data))
+                if first and first >= len(data): return f"ERR range: start byte {first} is past the end of '{file_path}'" + (f" ({len(data)} bytes)." if complete else ".")
+                text = data[first:last].decode("utf-8", errors="ignore")
+                locator = f"[{file_path} bytes {first}-{last}" + (f" of {len(data)}]" if complete else "]")
+            else:
+                first = max(start or 1, 1); content, complete = self._read_text(file_path, stop_lines=end)
+                lines = content.splitlines(); last = min(end, len(lines)) if end is not None else len(lines)
+                if first > max(len(lines), 1): return f"ERR range: start line {first} is past the end of '{file_path}'" + (f" ({len(lines)} lines)." if complete else ".")
+                text = "\n".join(lines[first - 1:last])
+                locator = f"[{file_path} lines {first}-{last}" + (f" of {len(lines)}]" if complete else "]")
+        except LookupError as e: return str(e)
+        except ValueError as e: return f"ERR range: {e} Request an earlier or narrower range."
+        except Exception as e: msg = f"ERR: Unexpected range read error: {e}"; logger.warning(msg); return msg
+        if max_chars is not None and len(text) > max_chars:
+            text = text[:max_chars] + f"\n[... slice cut at {max_chars} characters; request a narrower range]"
+        return f"{locator}\n{text}"
 
     def create_or_update_file(self, file_path: str, content: str, commit_message: str) -> str:
-        if not self.repo: return "Error: Repo object uninitialized."
-        print(f"\nTOOL: Write file: {file_path}..."); sha = None
+        if not self.ready: return "Error: Repo object uninitialized."
+        logger.info(f"TOOL: Write file: {file_path}..."); sha = None
         try:
-            item = self.repo.get_contents(file_path, ref=self.branch)
-            if not isinstance(item, list) and item.type == 'file': sha = item.sha; print("File exists, updating.")
-            else: print(f"WARN: Path exists but not file: '{file_path}'.")
-        except UnknownObjectException: print("File not exist, creating."); sha = None
-        except GithubException as e: msg = f"ERR: Check exists GH: {e}"; print(msg); return msg
-        except Exception as e: msg = f"ERR: Unexpected check error: {e}"; print(msg); return msg
+            index = self.get_tree_index(); parent_sha = self.head_sha; entry = index.get(file_path)
+            if entry is not None: sha = entry["sha"]; logger.debug("File exists, updating.")
+            elif any(path.startswith(file_path.rstrip("/") + "/") for path in index): logger.warning(f"WARN: Path exists but not file: '{file_path}'.")
+            else: logger.debug("File not exist, creating.")
+        except GithubException as e: msg = f"ERR: Check exists GH: {e}"; logger.warning(msg); return msg
+        except Exception as e: msg = f"ERR: Unexpected check error: {e}"; logger.warning(msg); return msg
+        guard = _tool_call_guard.get()
+        if guard is not None and not guard.claim(): msg = f"ERR: Write to '{file_path}' abandoned: the tool call timed out before it was applied."; logger.warning(msg); return msg
+        session = _active_write_session.get()
+        if session is not None:
+            action = "(update)" if sha or file_path in session.pending else "(create)"
+            try: session.stage(file_path, content, commit_message, sha)
+            except RuntimeError as e: msg = f"ERR: Write '{file_path}': {e}"; logger.warning(msg); return msg
+            success_msg = f"Success {action} '{file_path}'. Staged; committed with the other changes when this run finishes."
+            logger.info(success_msg); return success_msg
         try:
             action = "(update)" if sha else "(create)"; msg = f"{commit_message} {action}"
-            if sha: resp = self.repo.update_file(path=file_path, message=msg, content=content, sha=sha, branch=self.branch)
-            else: resp = self.repo.create_file(path=file_path, message=msg, content=content, branch=self.branch)
-            success_msg = f"Success {action} '{file_path}'. Commit: {resp['commit'].sha}"
-            print(success_msg); return success_msg
-        except GithubException as e: msg = f"ERR: Write GH op {action}: {e}"; print(msg); return msg
-        except Exception as e: msg = f"ERR: Unexpected write error: {e}"; print(msg); return msg
+            commit_sha, parents, blob_sha = self._write_file(file_path, content, msg, sha)
+            self._record_commit(parent_sha if parent_sha in parents else None, commit_sha, {file_path: (blob_sha, content)})
+            success_msg = f"Success {action} '{file_path}'. Commit: {commit_sha}"
+            logger.info(success_msg); return success_msg
+        except GithubException as e: msg = f"ERR: Write GH op {action}: {e}"; logger.warning(msg); return msg
+        except Exception as e: msg = f"ERR: Unexpected write error: {e}"; logger.warning(msg); return msg
+
+    def _write_file(self, file_path: str, content: str, message: str, sha: Optional[str]) -> tuple:
+        """ Commits one file directly on the branch; returns (commit_sha, parent_shas, blob_sha). """
+        if sha: resp = self.transport.call("contents_update", self.repo.update_file, path=file_path, message=message, content=content, sha=sha, branch=self.branch)
+        else: resp = self.transport.call("contents_create", self.repo.create_file, path=file_path, message=message, content=content, branch=self.branch)
+        commit = resp['commit']
+        return commit.sha, [p.sha for p in commit.parents], resp['content'].sha
+
+    @contextmanager
+    def write_session(self):
+        """ Buffers every create_or_update_file call in this context; publish with commit_session(). """
+        session = WriteSession(); token = _active_write_session.set(session)
+        try: yield session
+        finally: _active_write_session.reset(token)
+
+    def commit_session(self, session: WriteSession) -> Optional[str]:
+        """ Publishes a session as one commit (blobs -> tree -> commit -> ref), rebasing onto the new head if the branch moved. """
+        if not session.pending: return None
+        if not self.ready: return "Error: Repo object uninitialized."
+        logger.info(f"Committing session: {len(session.pending)} file(s)...")
+        try:
+            blobs = {path: self.transport.call("create_blob", self.repo.create_git_blob, content, "utf-8").sha for path, content in session.pending.items()}
+            elements = [InputGitTreeElement(path, "100644", "blob", sha=blob_sha) for path, blob_sha in blobs.items()]
+            message = session.commit_message()
+            for attempt in range(1, self.SESSION_COMMIT_ATTEMPTS + 1):
+                ref = self.transport.call("git_ref", self.repo.get_git_ref, f"heads/{self.branch}"); head_sha = ref.object.sha
+                index = self.get_tree_index(head_sha)
+                conflicts = [p for p in session.pending if index.get(p, {}).get("sha") != session.base_shas[p]]
+                if conflicts: msg = f"ERR: Session commit conflict, changed on '{self.branch}' since read: {', '.join(conflicts)}."; logger.warning(msg); return msg
+                base_commit = self.transport.call("git_commit", self.repo.get_git_commit, head_sha)
+                tree = self.transport.call("create_tree", self.repo.create_git_tree, elements, base_commit.tree)
+                commit = self.transport.call("create_commit", self.repo.create_git_commit, message, tree, [base_commit])
+                try: self.transport.call("update_ref", ref.edit, commit.sha, force=False)
+                except GithubException as e:
+                    if e.status == 422 and attempt < self.SESSION_COMMIT_ATTEMPTS: logger.info(f"  Branch moved (attempt {attempt}), rebasing onto new head..."); continue
+                    raise
+                self._record_commit(head_sha, commit.sha, {path: (blobs[path], content) for path, content in session.pending.items()})
+                success_msg = f"Success committed {len(session.pending)} file(s): {', '.join(session.pending)}. Commit: {commit.sha}"
+                logger.info(success_msg); return success_msg
+        except GithubException as e: msg = f"ERR: Session commit GH: {e}"; logger.warning(msg); return msg
+        except Exception as e: msg = f"ERR: Unexpected session commit error: {e}"; logger.warning(msg); return msg
+
+    @staticmethod
+    def _apply_edits(content: str, edits: List[dict]) -> tuple:
+        """ Applies anchored line edits in order; returns (new_content, per-edit report, all_ok). Only CRLF, LF and CR end a line,
+            and every line keeps its own terminator; new lines take the terminator of the line they replace or sit next to. """
+        lines = _split_lines(content); report = []; all_ok = True
+        default_eol = next((eol for _, eol in lines if eol), "\n")
+        for i, edit in enumerate(edits, 1):
+            op = edit.get("op") or "replace"; anchor = edit.get("anchor") or ""; end_anchor = edit.get("end_anchor")
+            occurrence = edit.get("occurrence"); new_texts = [text for text, _ in _split_lines(edit.get("content") or "")] or [""]
+            if op not in ("replace", "insert_before", "insert_after", "delete"): report.append(f"Edit {i}: FAILED, unknown op '{op}'."); all_ok = False; continue
+            if not anchor: report.append(f"Edit {i}: FAILED, empty anchor."); all_ok = False; continue
+            matches = [n for n, (line, _) in enumerate(lines) if anchor in line]
+            if not matches: report.append(f"Edit {i}: FAILED, anchor '{anchor}' not found."); all_ok = False; continue
+            if occurrence:
+                if not 1 <= occurrence <= len(matches): report.append(f"Edit {i}: FAILED, anchor '{anchor}' has {len(matches)} match(es), occurrence {occurrence} requested."); all_ok = False; continue
+                start = matches[occurrence - 1]
+            elif len(matches) > 1: report.append(f"Edit {i}: FAILED, anchor '{anchor}' is ambiguous ({len(matches)} matches, lines {', '.join(str(n + 1) for n in matches[:5])}); set 'occurrence'."); all_ok = False; continue
+            else: start = matches[0]
+            end = start
+            if end_anchor:
+                end = next((n for n in range(start, len(lines)) if end_anchor in lines[n][0]), None)
+                if end is None: report.append(f"Edit {i}: FAILED, end_anchor '{end_anchor}' not found at/after line {start + 1}."); all_ok = False; continue
+            last_eol = lines[end][1]; eol = lines[start][1] or default_eol # last_eol is "" only on a final line without newline
+            if op == "replace": lines[start:end + 1] = [[text, eol] for text in new_texts[:-1]] + [[new_texts[-1], last_eol]]
+            elif op == "delete":
+                del lines[start:end + 1]
+                if not last_eol and lines and start == len(lines): lines[-1][1] = "" # Deleted the final line: keep "no newline at end of file"
+            elif op == "insert_before": lines[start:start] = [[text, eol] for text in new_texts]
+            else:
+                if not last_eol: lines[end][1] = default_eol
+                lines[end + 1:end + 1] = [[text, last_eol or default_eol] for text in new_texts[:-1]] + [[new_texts[-1], last_eol]]
+            report.append(f"Edit {i}: OK, {op} at line {start + 1}" + (f"-{end + 1}" if end != start else "") + ".")
+        return "".join(text + eol for text, eol in lines), report, all_ok
+
+    def patch_file(self, file_path: str, edits: List[dict], commit_message: str) -> str:
+        """ Applies a batch of anchored edits to one file with a single read and a single write. Nothing is written unless every edit applies. """
+        logger.info(f"TOOL: Patch file: {file_path}, {len(edits)} edit(s)")
+        edits = [e.model_dump() if hasattr(e, "model_dump") else dict(e) for e in edits]
+        if not edits: msg = "ERR patch: No edits given."; logger.warning(msg); return msg
+        content = self.get_file_content(file_path)
+        if content.startswith("Error:") or content.startswith("ERR"): return f"ERR patch: Cannot read file. {content}"
+        new_content, report, all_ok = self._apply_edits(content, edits)
+        if not all_ok: msg = f"ERR patch: No changes written to '{file_path}'.\n" + "\n".join(report); logger.warning(msg); return msg
+        if new_content == content: msg = f"No changes: edits leave '{file_path}' unchanged.\n" + "\n".join(report); logger.info(msg); return msg
+        logger.debug("All edits applied, writing...")
+        return self.create_or_update_file(file_path, new_content, commit_message) + "\n" + "\n".join(report)
 
     def update_file_section(self, file_path: str, target_section_identifier: str, new_content_for_section: str, commit_message: str) -> str:
-        print(f"\nTOOL: Update section: {file_path}, target: '{target_section_identifier}'")
+        logger.info(f"TOOL: Update section: {file_path}, target: '{target_section_identifier}'")
         content = self.get_file_content(file_path)
         if content.startswith("Error:"): return f"ERR update: Cannot read file. {content}"
-        lines = content.splitlines(); found = False; modified = []
-        for line in lines:
-            if not found and target_section_identifier in line:
-                modified.append(new_content_for_section); found = True; print("Target line found & replaced.")
-            else: modified.append(line)
-        if not found: msg = f"ERR update: Target '{target_section_identifier}' not found in '{file_path}'."; print(msg); return msg
-        mod_content = "\n".join(modified); print("Committing section update...")
+        edit = {"op": "replace", "anchor": target_section_identifier, "content": new_content_for_section, "occurrence": 1}
+        mod_content, _, found = self._apply_edits(content, [edit])
+        if not found: msg = f"ERR update: Target '{target_section_identifier}' not found in '{file_path}'."; logger.warning(msg); return msg
+        logger.debug("Target line found & replaced. Committing section update...")
         return self.create_or_update_file(file_path, mod_content, commit_message)
 
 
+class LocalGitBackend(Github_Auto):
+    """ Same tool surface as Github_Auto, backed by a bare local mirror of one branch: listings and reads come from the
+        local object store, writes are local commits, and unpushed commits are pushed in batches (fetch + rebase on rejection). """
+    GIT_TIMEOUT_SECONDS = 60
+    CONFLICT_REF_PREFIX = "refs/github_auto/conflicts"
+    NETWORK_COMMANDS = ("fetch", "push", "ls-remote") # The only git commands that get the token
+
+    def __init__(self, remote_url: str, mirror_path: str, branch: str = "main", content_cache_bytes: int = 8 * 1024 * 1024,
+                 fetch_interval: float = 30.0, push_interval: float = 10.0, repo_name: Optional[str] = None, max_blob_bytes: int = 20 * 1024 * 1024,
+                 token: Optional[str] = None):
+        if not remote_url: raise ValueError("Git remote URL required.")
+        self._init_state(repo_name or remote_url, branch, content_cache_bytes, max_blob_bytes)
+        self.token = token; self.remote_url = remote_url; self.mirror_path = mirror_path
+        self.fetch_interval = fetch_interval; self.push_interval = push_interval
+        self._local_ref = f"refs/heads/{branch}"; self._remote_ref = f"refs/remotes/origin/{branch}"
+        self._write_lock = threading.RLock() # Serializes ref updates, rebases and pushes
+        self._last_fetch = 0.0; self._last_push: Optional[str] = None
+        self._stats: Dict[str, dict] = {}; self._stats_lock = threading.Lock()
+        self._init_mirror(); self.ready = True
+        if push_interval > 0: threading.Thread(target=self._push_loop, name="git-push", daemon=True).start()
+
+    def _git(self, *args: str, input: Optional[bytes] = None, env: Optional[Dict[str, str]] = None, check: bool = True, git_dir: bool = True) -> subprocess.CompletedProcess:
+        """ Runs one git command against the mirror; raises RuntimeError with git's stderr when check is set and it fails. """
+        command = ["git", "--git-dir", self.mirror_path, *args] if git_dir else ["git", *args]
+        started = time.perf_counter()
+        proc = subprocess.run(command, input=input, capture_output=True, timeout=self.GIT_TIMEOUT_SECONDS,
+                              env={**os.environ, "GIT_TERMINAL_PROMPT": "0", **(self._auth_env() if args[0] in self.NETWORK_COMMANDS else {}), **(env or {})})
+        elapsed = time.perf_counter() - started; subcommand = args[0]
+        record_span("git", subcommand, elapsed, returncode=proc.returncode)
+        with self._stats_lock:
+            entry = self._stats.setdefault(subcommand, {"calls": 0, "errors": 0, "seconds": 0.0})
+            entry["calls"] += 1; entry["seconds"] += elapsed; entry["errors"] += proc.returncode != 0
+        if check and proc.returncode != 0: raise RuntimeError(f"git {subcommand} failed: {proc.stderr.decode('utf-8', 'replace').strip()}")
+        return proc
+
+    def _auth_env(self) -> Dict[str, str]:
+        """ Token as an HTTP header for this one process (GIT_CONFIG_* env), so it is never written to the mirror's config. """
+        if not self.token: return {}
+        basic = base64.b64encode(f"x-access-token:{self.token}".encode("utf-8")).decode("ascii")
+        return {"GIT_CONFIG_COUNT": "1", "GIT_CONFIG_KEY_0": "http.extraHeader", "GIT_CONFIG_VALUE_0": f"Authorization: Basic {basic}"}
+
+    def _out(self, *args: str, **kwargs) -> str:
+        return self._git(*args, **kwargs).stdout.decode("utf-8").strip()
+
+    def _rev(self, ref: str) -> Optional[str]:
+        proc = self._git("rev-parse", "--verify", "-q", f"{ref}^{{commit}}", check=False)
+        return proc.stdout.decode("utf-8").strip() if proc.returncode == 0 else None
+
+    def _is_ancestor(self, ancestor: str, descendant: str) -> bool:
+        return self._git("merge-base", "--is-ancestor", ancestor, descendant, check=False).returncode == 0
+
+    def _init_mirror(self) -> None:
+        if not os.path.exists(os.path.join(self.mirror_path, "HEAD")):
+            os.makedirs(self.mirror_path, exist_ok=True); self._git("init", "-q", "--bare", self.mirror_path, git_dir=False)
+            logger.info(f"Initialized git mirror at {self.mirror_path}.")
+        if self._git("remote", "get-url", "origin", check=False).returncode == 0: self._git("remote", "set-url", "origin", self.remote_url)
+        else: self._git("remote", "add", "origin", self.remote_url)
+        with self._write_lock: self._fetch()
+        if self._rev(self._local_ref) is None: logger.warning(f"WARN: Target branch '{self.branch}' nonexistent on remote; it is created on first push.")
+        else: logger.info(f"Git mirror ready: {self.branch} @ {self._rev(self._local_ref)[:7]}.")
+
+    def _fetch(self) -> None:
+        """ Updates origin/<branch> and fast-forwards the local branch when it has nothing unpushed. Caller holds _write_lock. """
+        proc = self._git("fetch", "-q", "origin", f"+refs/heads/{self.branch}:{self._remote_ref}", check=False)
+        if proc.returncode != 0 and b"couldn't find remote ref" not in proc.stderr: raise RuntimeError(f"git fetch failed: {proc.stderr.decode('utf-8', 'replace').strip()}")
+        self._last_fetch = time.monotonic()
+        local, remote = self._rev(self._local_ref), self._rev(self._remote_ref)
+        if remote and (local is None or (local != remote and self._is_ancestor(local, remote))):
+            self._git("update-ref", self._local_ref, remote, *([local] if local else [])); logger.debug(f"Fast-forwarded {self.branch} to {remote[:7]}.")
+
+    def _head_commit_sha(self) -> str:
+        """ Local branch head; refreshed from the remote at most every fetch_interval seconds. """
+        if time.monotonic() - self._last_fetch >= self.fetch_interval:
+            with self._write_lock:
+                try: self._fetch()
+                except Exception as e: logger.warning(f"WARN: Git fetch failed, serving local mirror: {e}")
+        head = self._rev(self._local_ref)
+        if head is None: raise UnknownObjectException(404, {"message": f"Branch '{self.branch}' not found"}, None)
+        return head
+
+    def _fetch_tree(self, head_sha: str) -> tuple:
+        """ (tree_sha, {path: entry}) from one local `git ls-tree -r -l`; never truncated. """
+        tree_sha = self._out("rev-parse", f"{head_sha}^{{tree}}"); index = {}
+        for record in self._git("ls-tree", "-r", "-l", "-z", head_sha).stdout.decode("utf-8").split("\0"):
+            if not record: continue
+            meta, path = record.split("\t", 1); _, kind, sha, size = meta.split()
+            if kind == "blob": index[path] = {"path": path, "size": int(size), "sha": sha}
+        self.tree_truncated = False; return tree_sha, index
+
+    def _fetch_blob(self, path: str, sha: str, size: Optional[int] = None) -> str:
+        if size is not None and size > self.max_blob_bytes: raise ValueError(f"'{path}' is {size} bytes, over the {self.max_blob_bytes} byte read limit.")
+        content = self._git("cat-file", "blob", sha).stdout.decode("utf-8")
+        self.content_cache.put(path, sha, content); return content
+
+    def _stream_blob(self, sha: str, stop_bytes: Optional[int] = None, stop_lines: Optional[int] = None) -> tuple:
+        data = self._git("cat-file", "blob", sha).stdout # Local object store: reading the whole blob is cheaper than a partial pipe
+        if len(data) > self.max_blob_bytes and stop_bytes is not None: return data[:stop_bytes], False
+        if len(data) > self.max_blob_bytes: raise ValueError(f"Blob exceeds the {self.max_blob_bytes} byte read limit.")
+        return data, True
+
+    def _commit_tree(self, parent_sha: Optional[str], changes: Dict[str, Optional[str]], message: str) -> str:
+        """ Writes a commit whose tree is the parent's with {path: blob_sha} applied (None deletes); a throwaway index keeps the mirror's own index untouched. """
+        index_file = os.path.join(self.mirror_path, f"index.github_auto.{uuid.uuid4().hex}"); env = {"GIT_INDEX_FILE": index_file}
+        identity = {key: os.environ.get(key, default) for key, default in (("GIT_AUTHOR_NAME", "github-auto"), ("GIT_AUTHOR_EMAIL", "github-auto@localhost"),
+                                                                            ("GIT_COMMITTER_NAME", "github-auto"), ("GIT_COMMITTER_EMAIL", "github-auto@localhost"))}
+        try:
+            if parent_sha: self._git("read-tree", parent_sha, env=env)
+            else: self._git("read-tree", "--empty", env=env)
+            removed = [path for path, sha in changes.items() if sha is None]
+            if removed: self._git("update-index", "--force-remove", "--", *removed, env=env)
+            info = "".join(f"100644 {sha}\t{path}\n" for path, sha in changes.items() if sha is not None)
+            if info: self._git("update-index", "--add", "--index-info", input=info.encode("utf-8"), env=env)
+            tree_sha = self._out("write-tree", env=env)
+            return self._out("commit-tree", tree_sha, *(["-p", parent_sha] if parent_sha else []), input=message.encode("utf-8"), env={**env, **identity})
+        finally:
+            if os.path.exists(index_file): os.remove(index_file)
+
+    def _commit_local(self, files: Dict[str, str], message: str) -> tuple:
+        """ Commits {path: content} on the local branch; returns (commit_sha, parent_sha, {path: blob_sha}). Caller holds _write_lock. """
+        parent_sha = self._rev(self._local_ref)
+        blobs = {path: self._out("hash-object", "-w", "--stdin", input=content.encode("utf-8")) for path, content in files.items()}
+        commit_sha = self._commit_tree(parent_sha, blobs, message)
+        self._git("update-ref", self._local_ref, commit_sha, *([parent_sha] if parent_sha else [])) # Compare-and-swap on the old head
+        return commit_sha, parent_sha, blobs
+
+    def _write_file(self, file_path: str, content: str, message: str, sha: Optional[str]) -> tuple:
+        """ Local commit only; the push loop (or the next session commit) publishes it. """
+        with self._write_lock: commit_sha, parent_sha, blobs = self._commit_local({file_path: content}, message)
+        return commit_sha, [parent_sha], blobs[file_path]
+
+    def commit_session(self, session: WriteSession) -> Optional[str]:
+        """ Publishes a session as one local commit and pushes it together with anything else still unpushed. """
+        if not session.pending: return None
+        logger.info(f"Committing session: {len(session.pending)} file(s)...")
+        try:
+            with self._write_lock:
+                head_sha = self._head_commit_sha(); index = self.get_tree_index(head_sha)
+                conflicts = [p for p in session.pending if index.get(p, {}).get("sha") != session.base_shas[p]]
+                if conflicts: msg = f"ERR: Session commit conflict, changed on '{self.branch}' since read: {', '.join(conflicts)}."; logger.warning(msg); return msg
+                commit_sha, parent_sha, blobs = self._commit_local(dict(session.pending), session.commit_message())
+                self._record_commit(parent_sha, commit_sha, {path: (blobs[path], content) for path, content in session.pending.items()})
+                pushed, parked = self._push()
+            if commit_sha in parked:
+                msg = f"ERR: Session commit not published: {pushed} Files: {', '.join(session.pending)}."; logger.warning(msg); return msg
+            success_msg = f"Success committed {len(session.pending)} file(s): {', '.join(session.pending)}. Commit: {commit_sha}. {pushed}"
+            logger.info(success_msg); return success_msg
+        except Exception as e: msg = f"ERR: Unexpected session commit error: {e}"; logger.warning(msg); return msg
+
+    def unpushed(self) -> int:
+        local, remote = self._rev(self._local_ref), self._rev(self._remote_ref)
+        if local is None or local == remote: return 0
+        return int(self._out("rev-list", "--count", local, *([f"^{remote}"] if remote else [])))
+
+    def push(self) -> str:
+        return self._push()[0]
+
+    def _push(self) -> tuple:
+        """ Pushes every unpushed local commit in one go; on rejection fetches, replays them onto the new remote head and retries.
+            Returns (message, {sha of each commit parked}). A commit touching a path that also changed remotely (or that an
+            earlier parked commit touched) is parked under CONFLICT_REF_PREFIX; the other commits are replayed and pushed. """
+        parked: Dict[str, str] = {}
+        with self._write_lock:
+            for attempt in range(1, self.SESSION_COMMIT_ATTEMPTS + 1):
+                local, remote = self._rev(self._local_ref), self._rev(self._remote_ref)
+                if local is None or local == remote: break
+                if remote and not self._is_ancestor(remote, local):
+                    rebased, conflicts = self._rebase_onto(remote, local)
+                    for commit, overlap in conflicts.items():
+                        ref = f"{self.CONFLICT_REF_PREFIX}/{int(time.time())}-{commit[:7]}"; self._git("update-ref", ref, commit)
+                        parked[commit] = ref; logger.warning(f"WARN: Parked local commit {commit[:7]} at {ref}: changed on '{self.branch}' remotely: {', '.join(overlap)}.")
+                    self._git("update-ref", self._local_ref, rebased, local); local = rebased
+                    if local == remote: break
+                count = self.unpushed()
+                proc = self._git("push", "-q", "--porcelain", "origin", f"{local}:refs/heads/{self.branch}", check=False)
+                if proc.returncode == 0:
+                    self._git("update-ref", self._remote_ref, local); self._last_push = local
+                    msg = f"Pushed {count} commit(s) to '{self.branch}' @ {local[:7]}."; logger.info(msg); return self._with_parked(msg, parked), parked
+                if attempt < self.SESSION_COMMIT_ATTEMPTS: logger.info(f"  Push rejected (attempt {attempt}), fetching and rebasing..."); self._fetch(); continue
+                msg = f"ERR: Push rejected, retried in the background: {(proc.stderr or proc.stdout).decode('utf-8', 'replace').strip()}"; logger.warning(msg)
+                return self._with_parked(msg, parked), parked
+        return self._with_parked("Nothing to push.", parked), parked
+
+    @staticmethod
+    def _with_parked(msg: str, parked: Dict[str, str]) -> str:
+        if not parked: return msg
+        return f"{msg} Conflicting with remote changes, kept unpublished at: {', '.join(parked.values())}."
+
+    def _rebase_onto(self, new_base: str, local: str) -> tuple:
+        """ Replays local-only commits onto new_base file by file. Returns (new head, {skipped commit: overlapping paths}):
+            a commit is skipped when it touches a path changed remotely or by an already skipped commit. """
+        merge_base = self._out("merge-base", new_base, local)
+        blocked = set(filter(None, self._git("diff-tree", "-r", "--name-only", "-z", merge_base, new_base).stdout.decode("utf-8").split("\0")))
+        current = new_base; conflicts: Dict[str, List[str]] = {}
+        for commit in self._out("rev-list", "--reverse", f"{merge_base}..{local}").split():
+            fields = self._git("diff-tree", "-r", "-z", "--no-commit-id", f"{commit}^", commit).stdout.decode("utf-8").split("\0")
+            changes = {path: (None if meta.split()[4] == "D" else meta.split()[3]) for meta, path in zip(fields[0::2], fields[1::2]) if meta}
+            overlap = sorted(blocked.intersection(changes))
+            if overlap: conflicts[commit] = overlap; blocked.update(changes); continue
+            current = self._commit_tree(current, changes, self._git("log", "-1", "--format=%B", commit).stdout.decode("utf-8"))
+        logger.info(f"Rebased local commits onto {new_base[:7]} -> {current[:7]} ({len(conflicts)} parked).")
+        return current, conflicts
+
+    def _push_loop(self) -> None:
+        while True:
+            time.sleep(self.push_interval)
+            try:
+                if self.unpushed(): self.push()
+            except Exception as e: logger.warning(f"WARN: Background git push failed: {e}")
+
+    def stats(self) -> dict:
+        with self._stats_lock: commands = {name: dict(entry) for name, entry in self._stats.items()}
+        return {"backend": "git", "mirror": self.mirror_path, "remote": re.sub(r"//[^/@]+@", "//***@", self.remote_url), "branch": self.branch,
+                "unpushed": self.unpushed(), "last_push": self._last_push, "last_fetch_age_s": round(time.monotonic() - self._last_fetch, 1), "commands": commands}
+
+
+class RepoSearchIndex:
+    """ In-process search over the repo: trigram fuzzy matching on paths plus an inverted full-text index over markdown under docs/.
+        Kept in sync by diffing blob SHAs between head trees, so only changed files are re-read; optionally persisted as JSON. """
+    TEXT_PREFIX = "docs/"; TEXT_SUFFIXES = (".md",)
+
+    def __init__(self, persist_path: Optional[str] = None):
+        self.persist_path = persist_path; self.head_sha: Optional[str] = None
+        self.files: Dict[str, str] = {} # path -> blob sha
+        self.texts: Dict[str, str] = {} # path -> content, for indexed docs only
+        self.trigrams: Dict[str, set] = {} # trigram -> paths
+        self.postings: Dict[str, Dict[str, int]] = {} # term -> {path: term count}
+        self.doc_lengths: Dict[str, int] = {}
+        self._lock = threading.Lock(); self._loaded = not persist_path # The persisted copy is read on first sync()/search(), not at import
+
+    @staticmethod
+    def _terms(text: str) -> List[str]: return [t for t in re.findall(r"[a-z0-9]+", text.lower()) if len(t) > 1]
+
+    @staticmethod
+    def _trigrams(text: str) -> set:
+        text = f"  {' '.join(re.split(r'[^a-z0-9]+', text.lower())).strip()} "; return {text[i:i + 3] for i in range(len(text) - 2)}
+
+    def _is_text(self, path: str) -> bool: return path.startswith(self.TEXT_PREFIX) and path.endswith(self.TEXT_SUFFIXES)
+
+    def _add(self, path: str, sha: str, text: Optional[str]) -> None:
+        self.files[path] = sha
+        for gram in self._trigrams(path): self.trigrams.setdefault(gram, set()).add(path)
+        if text is None: return
+        self.texts[path] = text; terms = self._terms(text); self.doc_lengths[path] = len(terms)
+        for term in terms: bucket = self.postings.setdefault(term, {}); bucket[path] = bucket.get(path, 0) + 1
+
+    def _remove(self, path: str) -> None:
+        self.files.pop(path, None)
+        for gram in self._trigrams(path):
+            paths = self.trigrams.get(gram)
+            if paths: paths.discard(path); paths or self.trigrams.pop(gram)
+        text = self.texts.pop(path, None); self.doc_lengths.pop(path, None)
+        for term in set(self._terms(text or "")):
+            bucket = self.postings.get(term)
+            if bucket: bucket.pop(path, None); bucket or self.postings.pop(term)
+
+    def sync(self, bot: "Github_Auto") -> int:
+        """ Brings the index up to the branch head, re-reading only blobs whose SHA changed. Returns the number of changed paths. """
+        tree = bot.get_tree_index(); head_sha = bot.head_sha
+        with self._lock:
+            self._ensure_loaded()
+            if head_sha == self.head_sha: return 0
+            current = {path: entry["sha"] for path, entry in tree.items()}
+            removed = [p for p in self.files if p not in current]
+            changed = [p for p, sha in current.items() if self.files.get(p) != sha]
+            for path in removed + [p for p in changed if p in self.files]: self._remove(path)
+            for path in changed:
+                try: text = bot.read_blob(path, current[path]) if self._is_text(path) else None
+                except Exception as e: logger.warning(f"  Warn: Cannot index '{path}': {e}"); text = None
+                self._add(path, current[path], text)
+            self.head_sha = head_sha
+            logger.info(f"Search index @ {head_sha[:7]}: {len(changed)} changed, {len(removed)} removed, {len(self.files)} files.")
+            if self.persist_path and (changed or removed): self._save()
+            return len(changed) + len(removed)
+
+    def search(self, query: str, limit: int = 10) -> List[dict]:
+        """ Ranked path and content matches for a filename fragment or free text. """
+        with self._lock:
+            self._ensure_loaded(); scores: Dict[str, float] = {}; reasons: Dict[str, str] = {}
+            q = query.strip().lower(); q_grams = self._trigrams(q)
+            candidates = {}
+            for gram in q_grams:
+                for path in self.trigrams.get(gram, ()): candidates[path] = candidates.get(path, 0) + 1
+            for path, shared in candidates.items():
+                name = path.rsplit("/", 1)[-1].lower()
+                score = shared / len(q_grams) # Share of the query's trigrams found in the path
+                if q and q in path.lower(): score += 1.0 if q in name else 0.5
+                if score >= 0.5: scores[path] = score * 2; reasons[path] = "path"
+            terms = self._terms(query); n_docs = max(len(self.texts), 1)
+            avg_length = max(sum(self.doc_lengths.values()) / n_docs, 1)
+            for term in set(terms):
+                bucket = self.postings.get(term, {})
+                idf = math.log(1 + n_docs / (1 + len(bucket)))
+                for path, count in bucket.items():
+                    tf = count / (count + 1.2 * (0.25 + 0.75 * self.doc_lengths[path] / avg_length)) # BM25-style saturation
+                    scores[path] = scores.get(path, 0) + tf * idf
+                    reasons[path] = "path+content" if reasons.get(path, "content").startswith("path") else "content"
+            ranked = sorted(scores.items(), key=lambda item: -item[1])[:limit]
+            return [{"path": path, "score": round(score, 3), "match": reasons[path], "snippet": self._snippet(path, terms)} for path, score in ranked]
+
+    def _snippet(self, path: str, terms: List[str]) -> str:
+        for n, line in enumerate((self.texts.get(path) or "").splitlines(), 1):
+            if any(term in line.lower() for term in terms): return f"L{n}: {line.strip()[:160]}"
+        return ""
+
+    def _save(self) -> None:
+        try:
+            tmp = f"{self.persist_path}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f: json.dump({"head_sha": self.head_sha, "files": self.files, "texts": self.texts}, f)
+            os.replace(tmp, self.persist_path)
+        except OSError as e: logger.warning(f"  Warn: Cannot persist search index: {e}")
+
+    def _ensure_loaded(self) -> None:
+        if self._loaded: return
+        self._loaded = True
+        if os.path.exists(self.persist_path): self._load()
+
+    def _load(self) -> None:
+        try:
+            with open(self.persist_path, encoding="utf-8") as f: data = json.load(f)
+            texts = data.get("texts", {})
+            for path, sha in data.get("files", {}).items(): self._add(path, sha, texts.get(path))
+            self.head_sha = data.get("head_sha"); logger.info(f"Search index loaded from disk: {len(self.files)} files @ {(self.head_sha or '?')[:7]}.")
+        except (OSError, ValueError) as e: logger.warning(f"  Warn: Cannot load search index: {e}")
+
+
+class ComponentUnavailable(RuntimeError):
+    """ Raised by LazyComponent.get() while a component is failed and waiting for its next retry. """
+
+
+class LazyComponent:
+    """ Builds an expensive dependency on first use (or from a warm-up thread) and retries failures with exponential backoff. """
+    def __init__(self, name: str, factory, retry_base: float = 2.0, retry_max: float = 60.0):
+        self.name = name; self.factory = factory; self.retry_base = retry_base; self.retry_max = retry_max
+        self.value = None; self.state = "idle" # idle -> initializing -> ready | failed
+        self.error: Optional[str] = None; self.attempts = 0; self.next_retry_at = 0.0; self.init_seconds: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        if self.state == "ready": return self.value
+        with self._lock:
+            if self.state == "ready": return self.value
+            if self.state == "failed" and time.monotonic() < self.next_retry_at:
+                raise ComponentUnavailable(f"{self.name} unavailable (retry in {self.next_retry_at - time.monotonic():.0f}s): {self.error}")
+            self.state = "initializing"; self.attempts += 1; started = time.monotonic()
+            logger.info(f"--- Initializing {self.name} (attempt {self.attempts}) ---")
+            try: value = self.factory()
+            except Exception as e:
+                delay = min(self.retry_base * 2 ** (self.attempts - 1), self.retry_max)
+                self.state = "failed"; self.error = f"{type(e).__name__}: {e}"; self.next_retry_at = time.monotonic() + delay
+                logger.error(f"FATAL: Failed to initialize {self.name}: {e} (retry in {delay:.0f}s)")
+                raise ComponentUnavailable(f"{self.name} unavailable: {self.error}") from e
+            self.value = value; self.state = "ready"; self.error = None; self.init_seconds = time.monotonic() - started
+            logger.info(f"--- {self.name} Initialized Successfully ({self.init_seconds:.2f}s) ---")
+            return value
+
+    def peek(self):
+        """ The value if already built; never blocks or triggers initialization. """
+        return self.value if self.state == "ready" else None
+
+    def status(self) -> dict:
+        status = {"state": self.state, "attempts": self.attempts}
+        if self.init_seconds is not None: status["init_seconds"] = round(self.init_seconds, 3)
+        if self.state == "failed": status["error"] = self.error; status["retry_in_seconds"] = max(round(self.next_retry_at - time.monotonic(), 1), 0)
+        return status
+
+
+class SessionCheckpointer(BaseCheckpointSaver):
+    """ LangGraph checkpointer for multi-turn sessions (thread_id = session id). Only each session's latest checkpoint is kept,
+        serialized, in an LRU bounded by max_bytes and expired after ttl seconds idle. With db_path every write also goes to
+        SQLite, so sessions survive restarts and memory eviction (until their TTL). """
+    DB_PURGE_INTERVAL = 60.0
+
+    def __init__(self, max_bytes: int = 32 * 1024 * 1024, ttl: float = 7200.0, db_path: Optional[str] = None):
+        super().__init__()
+        self.max_bytes = max_bytes; self.ttl = ttl; self.db_path = db_path; self.bytes_used = 0
+        self._sessions: "OrderedDict[str, dict]" = OrderedDict() # thread_id -> record, least recently used first
+        self.evictions = 0; self.expirations = 0; self._last_purge = 0.0
+        self._lock = threading.RLock() # Graph steps of different sessions checkpoint concurrently
+        self._db = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS sessions (thread_id TEXT PRIMARY KEY, touched REAL, record_type TEXT, record BLOB)")
+            self._purge_db()
+
+    @staticmethod
+    def _size(record: dict) -> int:
+        return len(record["checkpoint"][1]) + len(record["metadata"][1]) + sum(len(w[3]) + len(w[1]) for w in record["writes"].values())
+
+    def _expired(self, record: dict) -> bool:
+        return time.time() - record["touched"] > self.ttl
+
+    def _drop(self, thread_id: str) -> None:
+        record = self._sessions.pop(thread_id, None)
+        if record: self.bytes_used -= record["size"]
+
+    def _purge_db(self) -> None:
+        self._db.execute("DELETE FROM sessions WHERE touched < ?", (time.time() - self.ttl,)); self._db.commit(); self._last_purge = time.monotonic()
+
+    def _load(self, thread_id: str) -> Optional[dict]:
+        """ The session's record, from memory or SQLite; None if unknown or expired. Caller holds _lock. """
+        record = self._sessions.get(thread_id)
+        if record is None and self._db is not None:
+            row = self._db.execute("SELECT record_type, record FROM sessions WHERE thread_id = ?", (thread_id,)).fetchone()
+            if row:
+                record = self.serde.loads_typed((row[0], row[1]))
+                record["checkpoint"] = tuple(record["checkpoint"]); record["metadata"] = tuple(record["metadata"]); record["size"] = self._size(record)
+                self._sessions[thread_id] = record; self.bytes_used += record["size"]; self._evict(keep=thread_id)
+        if record is None: return None
+        if self._expired(record): self.delete_thread(thread_id); self.expirations += 1; return None
+        self._sessions.move_to_end(thread_id); return record
+
+    def _store(self, thread_id: str, record: dict) -> None:
+        """ Caller holds _lock. """
+        record["touched"] = time.time(); self._drop(thread_id)
+        record["size"] = self._size(record); self._sessions[thread_id] = record; self.bytes_used += record["size"]
+        self._evict(keep=thread_id)
+        if self._db is not None:
+            record_type, blob = self.serde.dumps_typed({k: v for k, v in record.items() if k != "size"})
+            self._db.execute("INSERT OR REPLACE INTO sessions VALUES (?, ?, ?, ?)", (thread_id, record["touched"], record_type, blob))
+            if time.monotonic() - self._last_purge > self.DB_PURGE_INTERVAL: self._purge_db()
+            else: self._db.commit()
+
+    def _evict(self, keep: str) -> None:
+        """ Expired sessions first, then least recently used ones until the byte budget holds. The session being written is never evicted. """
+        for thread_id in [t for t, r in self._sessions.items() if t != keep and self._expired(r)]: self._drop(thread_id); self.expirations += 1
+        while self.bytes_used > self.max_bytes and len(self._sessions) > 1:
+            thread_id = next(t for t in self._sessions if t != keep); self._drop(thread_id); self.evictions += 1 # Still in SQLite, if configured
+
+    def _tuple(self, thread_id: str, checkpoint_ns: str, record: dict) -> CheckpointTuple:
+        parent = {"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": record["parent_id"]}} if record["parent_id"] else None
+        return CheckpointTuple(config={"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": record["id"]}},
+                               checkpoint=self.serde.loads_typed(record["checkpoint"]), metadata=self.serde.loads_typed(record["metadata"]), parent_config=parent,
+                               pending_writes=[(task_id, channel, self.serde.loads_typed((value_type, value))) for task_id, channel, value_type, value, _ in record["writes"].values()])
+
+    def get_tuple(self, config: dict) -> Optional[CheckpointTuple]:
+        configurable = config["configurable"]; thread_id = configurable["thread_id"]; checkpoint_id = configurable.get("checkpoint_id")
+        with self._lock: record = self._load(thread_id)
+        if record is None or (checkpoint_id and checkpoint_id != record["id"]): return None # Earlier checkpoints are not kept
+        return self._tuple(thread_id, configurable.get("checkpoint_ns", ""), record)
+
+    def list(self, config: Optional[dict], *, filter: Optional[dict] = None, before: Optional[dict] = None, limit: Optional[int] = None):
+        with self._lock: thread_ids = [config["configurable"]["thread_id"]] if config else list(self._sessions)
+        for thread_id in thread_ids[:limit]:
+            found = self.get_tuple({"configurable": {"thread_id": thread_id}})
+            if found is None or (before and found.config["configurable"]["checkpoint_id"] >= before["configurable"]["checkpoint_id"]): continue
+            if filter and any(found.metadata.get(k) != v for k, v in filter.items()): continue
+            yield found
+
+    def put(self, config: dict, checkpoint: dict, metadata: dict, new_versions: dict) -> dict:
+        configurable = config["configurable"]; thread_id = configurable["thread_id"]
+        record = {"id": checkpoint["id"], "parent_id": configurable.get("checkpoint_id"), "writes": {},
+                  "checkpoint": self.serde.dumps_typed(checkpoint), "metadata": self.serde.dumps_typed(metadata)}
+        with self._lock: self._store(thread_id, record)
+        return {"configurable": {"thread_id": thread_id, "checkpoint_ns": configurable.get("checkpoint_ns", ""), "checkpoint_id": checkpoint["id"]}}
+
+    def put_writes(self, config: dict, writes, task_id: str, task_path: str = "") -> None:
+        configurable = config["configurable"]
+        with self._lock:
+            record = self._load(configurable["thread_id"])
+            if record is None or record["id"] != configurable.get("checkpoint_id"): return # Writes of a superseded checkpoint
+            for idx, (channel, value) in enumerate(writes):
+                special = CHECKPOINT_WRITES_IDX_MAP.get(channel); key = f"{task_id}:{special if special is not None else idx}"
+                if special is not None and key in record["writes"]: continue
+                record["writes"][key] = (task_id, channel, *self.serde.dumps_typed(value), task_path)
+            self._store(configurable["thread_id"], record)
+
+    def delete_thread(self, thread_id: str) -> None:
+        with self._lock:
+            self._drop(thread_id)
+            if self._db is not None: self._db.execute("DELETE FROM sessions WHERE thread_id = ?", (thread_id,)); self._db.commit()
+
+    def snapshot(self, thread_id: str) -> Optional[dict]:
+        """ The session's current record, for restore() if a turn has to be rolled back. """
+        with self._lock:
+            record = self._load(thread_id)
+            return dict(record, writes=dict(record["writes"])) if record else None
+
+    def restore(self, thread_id: str, record: Optional[dict]) -> None:
+        if record is None: self.delete_thread(thread_id); return
+        with self._lock: self._store(thread_id, dict(record))
+
+    def stats(self) -> dict:
+        with self._lock:
+            stored = self._db.execute("SELECT COUNT(*) FROM sessions").fetchone()[0] if self._db is not None else len(self._sessions)
+            return {"sessions": len(self._sessions), "stored_sessions": stored, "bytes_used": self.bytes_used, "max_bytes": self.max_bytes,
+                    "ttl_seconds": self.ttl, "evictions": self.evictions, "expirations": self.expirations, "db_path": self.db_path}
+
+
 # === 2. Configuration and Initialization (Same as before) ===
 load_dotenv()
+configure_logging(os.environ.get("LOG_LEVEL", "INFO"), os.environ.get("LOG_FORMAT", "text")) # LOG_FORMAT=json for structured logs
 GOOGLE_API_KEY = os.environ.get("GOOGLE_API_KEY")
 GITHUB_TOKEN = os.environ.get("GITHUB_TOKEN")
 GITHUB_REPO_NAME = os.environ.get("GITHUB_REPO_NAME")
 GITHUB_BRANCH = os.environ.get("GITHUB_BRANCH", "main")
+CONTENT_CACHE_BYTES = int(os.environ.get("CONTENT_CACHE_BYTES", 8 * 1024 * 1024)) # Memory budget for decoded file contents
+MAX_BLOB_BYTES = int(os.environ.get("MAX_BLOB_BYTES", 20 * 1024 * 1024)) # Hard limit for fetching one file; larger files are only readable by byte range
+READ_FILE_MAX_CHARS = int(os.environ.get("READ_FILE_MAX_CHARS", 60000)) # read_github_file / range results longer than this are cut with a pointer to the range tools
+SEARCH_INDEX_PATH = os.environ.get("SEARCH_INDEX_PATH") # Optional JSON file so restarts don't re-crawl docs/
+GITHUB_POOL_SIZE = int(os.environ.get("GITHUB_POOL_SIZE", 10)) # Keep-alive connections shared by all sessions
+GITHUB_MAX_RETRIES = int(os.environ.get("GITHUB_MAX_RETRIES", 5)) # Jittered retries on 403/429/5xx
+GITHUB_RATE_RESERVE = int(os.environ.get("GITHUB_RATE_RESERVE", 100)) # Requests held back before the hourly limit
+GITHUB_PACE_BELOW = int(os.environ.get("GITHUB_PACE_BELOW", 1000)) # Unpaced while more requests than this remain; below it the rest above the reserve is spread until reset
+GITHUB_MAX_RATE_LIMIT_WAIT = float(os.environ.get("GITHUB_MAX_RATE_LIMIT_WAIT", 30)) # Longest sleep for a rate-limit reset; longer waits fail the call with ERR instead
 DIRECTORY_STRUCTURE = { "ingredient": "docs/ingredients", "formulation": "docs/formulations", "test_result": "data/results", "default": "docs" }
 BASE_TEMPLATE_PATH = "base_template.md"
+TOOL_POOL_SIZE = int(os.environ.get("TOOL_POOL_SIZE", 4)) # Worker threads shared by all tool calls
+TOOL_TIMEOUT_SECONDS = float(os.environ.get("TOOL_TIMEOUT_SECONDS", 60))
+# Per-tool overrides, e.g. TOOL_TIMEOUTS="list_github_files=20,write_github_file=90"
+TOOL_TIMEOUTS = {name.strip(): float(sec) for name, sec in (item.split("=", 1) for item in os.environ.get("TOOL_TIMEOUTS", "").split(",") if "=" in item)}
+CONTEXT_TOKEN_BUDGET = int(os.environ.get("CONTEXT_TOKEN_BUDGET", 12000)) # Estimated prompt tokens before old tool results are compacted
+SSE_HEARTBEAT_SECONDS = float(os.environ.get("SSE_HEARTBEAT_SECONDS", 15)) # Comment ping while no event is ready
+SSE_RETRY_MS = int(os.environ.get("SSE_RETRY_MS", 2000)) # Client reconnect delay advertised to EventSource
+RUN_RETENTION_SECONDS = float(os.environ.get("RUN_RETENTION_SECONDS", 300)) # Finished runs stay resumable this long
+RUN_REGISTRY_SIZE = int(os.environ.get("RUN_REGISTRY_SIZE", 100))
+RUN_DISCONNECT_GRACE_SECONDS = float(os.environ.get("RUN_DISCONNECT_GRACE_SECONDS", 30)) # Cancel a run if no client resumes within this
+AGENT_WORKERS = int(os.environ.get("AGENT_WORKERS", 4)) # Agent runs executing at once
+AGENT_QUEUE_DEPTH = int(os.environ.get("AGENT_QUEUE_DEPTH", 8)) # Runs waiting for a worker before new prompts are refused (429, or an error event for EventSource)
+LLM_CONCURRENCY = int(os.environ.get("LLM_CONCURRENCY", 4)) # Gemini calls in flight across all runs
+GITHUB_CONCURRENCY = int(os.environ.get("GITHUB_CONCURRENCY", 8)) # GitHub API calls in flight across all runs
+SESSION_STORE_BYTES = int(os.environ.get("SESSION_STORE_BYTES", 32 * 1024 * 1024)) # In-memory budget for multi-turn session checkpoints
+SESSION_TTL_SECONDS = float(os.environ.get("SESSION_TTL_SECONDS", 7200)) # Sessions idle longer than this are dropped
+SESSION_DB_PATH = os.environ.get("SESSION_DB_PATH") # Optional SQLite file so sessions survive restarts and memory eviction
+SESSION_KNOWN_FILES = int(os.environ.get("SESSION_KNOWN_FILES", 100)) # Resolved paths (with blob SHAs) remembered per session
+CONTEXT_KEEP_RECENT_TOOL_RESULTS = int(os.environ.get("CONTEXT_KEEP_RECENT_TOOL_RESULTS", 4)) # Newest ToolMessages never stubbed; cut to a head only if they alone exceed the budget
+COMPACT_MIN_KEPT_CHARS = int(os.environ.get("COMPACT_MIN_KEPT_CHARS", 2000)) # Recent results are never cut below this many characters
+REPO_BACKEND = os.environ.get("REPO_BACKEND", "github") # "github" (REST/Git Data API) or "git" (local mirror, batched pushes)
+GIT_REMOTE_URL = os.environ.get("GIT_REMOTE_URL") # Defaults to the GitHub repo over HTTPS; a local bare repo path works too
+GIT_MIRROR_PATH = os.environ.get("GIT_MIRROR_PATH") or os.path.join(tempfile.gettempdir(), "github_auto_mirror", (GITHUB_REPO_NAME or "repo").replace("/", "__"))
+GIT_FETCH_INTERVAL_SECONDS = float(os.environ.get("GIT_FETCH_INTERVAL_SECONDS", 30)) # Max staleness of the mirror before a read fetches
+GIT_PUSH_INTERVAL_SECONDS = float(os.environ.get("GIT_PUSH_INTERVAL_SECONDS", 10)) # Unpushed local commits are flushed this often; 0 = only on session commit
 if not GOOGLE_API_KEY: raise ValueError("GOOGLE_API_KEY missing.")
-if not GITHUB_TOKEN: raise ValueError("GITHUB_TOKEN missing.")
+if not GITHUB_TOKEN and not (REPO_BACKEND == "git" and GIT_REMOTE_URL): raise ValueError("GITHUB_TOKEN missing.")
 if not GITHUB_REPO_NAME: raise ValueError("GITHUB_REPO_NAME missing.")
-try:
-    print("\n--- Initializing Github Bot ---")
-    github_bot = Github_Auto(token=GITHUB_TOKEN, repo_name=GITHUB_REPO_NAME, branch=GITHUB_BRANCH)
-    print("--- Github Bot Initialized Successfully ---")
-except Exception as e: print(f"FATAL: Failed to initialize Github_Auto: {e}"); github_bot = None
+INIT_RETRY_BASE_SECONDS = float(os.environ.get("INIT_RETRY_BASE_SECONDS", 2)) # Backoff after a failed GitHub/LLM/graph init
+INIT_RETRY_MAX_SECONDS = float(os.environ.get("INIT_RETRY_MAX_SECONDS", 60))
+WARMUP_ON_START = os.environ.get("WARMUP_ON_START", "1") == "1" # Initialize components in a background thread at import
+
+# Nothing below talks to GitHub or Gemini at import; each component is built on first use (or by warm_up()).
+def make_github_bot() -> Github_Auto:
+    if REPO_BACKEND == "git":
+        # The token goes only to GitHub itself, as a per-command header; a custom remote authenticates through git's own credential setup
+        remote_url = GIT_REMOTE_URL or f"https://github.com/{GITHUB_REPO_NAME}.git"
+        return LocalGitBackend(remote_url, GIT_MIRROR_PATH, branch=GITHUB_BRANCH, content_cache_bytes=CONTENT_CACHE_BYTES,
+                               fetch_interval=GIT_FETCH_INTERVAL_SECONDS, push_interval=GIT_PUSH_INTERVAL_SECONDS, repo_name=GITHUB_REPO_NAME, max_blob_bytes=MAX_BLOB_BYTES,
+                               token=None if GIT_REMOTE_URL else GITHUB_TOKEN)
+    transport = GithubTransport(GITHUB_TOKEN, pool_size=GITHUB_POOL_SIZE, max_retries=GITHUB_MAX_RETRIES, rate_reserve=GITHUB_RATE_RESERVE, max_concurrency=GITHUB_CONCURRENCY,
+                                max_rate_wait=GITHUB_MAX_RATE_LIMIT_WAIT, pace_below=GITHUB_PACE_BELOW)
+    return Github_Auto(token=GITHUB_TOKEN, repo_name=GITHUB_REPO_NAME, branch=GITHUB_BRANCH, content_cache_bytes=CONTENT_CACHE_BYTES, transport=transport, max_blob_bytes=MAX_BLOB_BYTES)
+github_component = LazyComponent("Github Bot", make_github_bot, INIT_RETRY_BASE_SECONDS, INIT_RETRY_MAX_SECONDS)
+
+search_index = RepoSearchIndex(SEARCH_INDEX_PATH)
+session_store = SessionCheckpointer(SESSION_STORE_BYTES, SESSION_TTL_SECONDS, SESSION_DB_PATH)
 
 # === 3. Define LangGraph Tools (Same as before) ===
-tools = []
-if github_bot:
-    @tool
-    def list_github_files(directory_path: str = "") -> List[str]:
-        """Lists files/directories within a specific directory path (default is root). Does not recurse."""
-        return github_bot.list_repository_files(directory_path)
-    @tool
-    def read_github_file(file_path: str) -> str:
-        """Reads the content of a specific file using its full path. Returns 'Error: File not found...' if the path is invalid."""
-        return github_bot.get_file_content(file_path)
-    @tool
-    def write_github_file(file_path: str, content: str, commit_message: str) -> str:
-        """Creates/Overwrites a file with the provided full path, content, and commit message."""
-        return github_bot.create_or_update_file(file_path, content, commit_message)
-    @tool
-    def update_file_section(file_path: str, target_section_identifier: str, new_content_for_section: str, commit_message: str) -> str:
-        """Updates a SINGLE line in an existing file identified by 'target_section_identifier'. Requires full path, identifier, new line content, commit message."""
-        return github_bot.update_file_section(file_path, target_section_identifier, new_content_for_section, commit_message)
-    tools = [list_github_files, read_github_file, write_github_file, update_file_section]
-    print(f"--- {len(tools)} GitHub Tools Registered ---")
-else: print("--- WARNING: GitHub Bot failed to initialize. GitHub tools are disabled. ---")
+class FileEdit(BaseModel):
+    """ One anchored edit for patch_github_file. """
+    op: str = Field("replace", description="'replace', 'insert_before', 'insert_after' or 'delete'.")
+    anchor: str = Field(..., description="Text contained in the first target line. Must match exactly one line unless 'occurrence' is set.")
+    end_anchor: Optional[str] = Field(None, description="Optional text in the last line of a multi-line range (searched from the anchor line onwards).")
+    content: str = Field("", description="New line(s) for replace/insert, separated by newlines. Ignored for delete.")
+    occurrence: Optional[int] = Field(None, description="1-based match to use when the anchor appears on several lines.")
+
+@tool
+def list_github_files(directory_path: str = "") -> List[dict]:
+    """Recursively lists files under a directory path (default is root). Each entry has 'path', 'size' (bytes) and blob 'sha'."""
+    return github_component.get().list_repository_files(directory_path)
+@tool
+def read_github_file(file_path: str) -> str:
+    """Reads the content of a specific file using its full path. Returns 'Error: File not found...' if the path is invalid. Very long files are cut; use get_file_outline and read_github_file_range for those."""
+    content = github_component.get().get_file_content(file_path)
+    if len(content) <= READ_FILE_MAX_CHARS: return content
+    return content[:READ_FILE_MAX_CHARS] + f"\n[... cut at {READ_FILE_MAX_CHARS} of {len(content)} characters ({content.count(chr(10)) + 1} lines). Use get_file_outline and read_github_file_range for the rest.]"
+@tool
+def read_github_file_range(file_path: str, start: Optional[int] = None, end: Optional[int] = None, unit: str = "lines", heading: Optional[str] = None) -> str:
+    """Reads part of a file: lines start..end (1-based, inclusive; the default unit), bytes start..end (unit='bytes', 0-based, end exclusive), or the whole section under a markdown/HTML heading (heading='Safety'). Prefer this over read_github_file for large files."""
+    return github_component.get().read_file_range(file_path, start, end, unit, heading, max_chars=READ_FILE_MAX_CHARS)
+@tool
+def get_file_outline(file_path: str) -> dict:
+    """Returns a file's size in bytes, its line count and its headings (markdown '#' or HTML <h1>-<h6>) with line numbers and levels."""
+    return github_component.get().get_file_outline(file_path)
+@tool
+def write_github_file(file_path: str, content: str, commit_message: str) -> str:
+    """Creates/Overwrites a file with the provided full path, content, and commit message."""
+    return github_component.get().create_or_update_file(file_path, content, commit_message)
+@tool
+def update_file_section(file_path: str, target_section_identifier: str, new_content_for_section: str, commit_message: str) -> str:
+    """Updates a SINGLE line in an existing file identified by 'target_section_identifier'. Requires full path, identifier, new line content, commit message."""
+    return github_component.get().update_file_section(file_path, target_section_identifier, new_content_for_section, commit_message)
+@tool
+def patch_github_file(file_path: str, edits: List[FileEdit], commit_message: str) -> str:
+    """Applies several anchored line edits (replace/insert_before/insert_after/delete) to one existing file in a single write. If any edit fails, nothing is written and a per-edit report is returned."""
+    return github_component.get().patch_file(file_path, edits, commit_message)
+@tool
+def search_github_files(query: str, limit: int = 10) -> List[dict]:
+    """Finds files by fuzzy filename/path match (e.g. 'test3', 'argan') and by words in the markdown under docs/. Returns ranked paths with a matching line snippet."""
+    logger.info(f"TOOL: Search files: '{query}'...")
+    try: search_index.sync(github_component.get()); return search_index.search(query, limit) or ["No matches."]
+    except Exception as e: msg = f"ERR: Search: {e}"; logger.warning(msg); return [msg]
+# Tools are always registered; while GitHub is unavailable each call returns the init error to the agent.
+tools = [list_github_files, read_github_file, read_github_file_range, get_file_outline, write_github_file, update_file_section, patch_github_file, search_github_files]
+logger.info(f"--- {len(tools)} GitHub Tools Registered ---")
 tool_executor = ToolExecutor(tools)
+READ_ONLY_TOOLS = {"list_github_files", "read_github_file", "read_github_file_range", "get_file_outline", "search_github_files"}
+tool_pool = ThreadPoolExecutor(max_workers=TOOL_POOL_SIZE, thread_name_prefix="tool")
 
 # === 4. Define LLM and Agent Logic ===
-llm = ChatGoogleGenerativeAI(model="gemini-1.5-flash-latest", google_api_key=GOOGLE_API_KEY, convert_system_message_to_human=True)
-llm_with_tools = llm.bind_tools(tools)
+def make_llm():
+    from langchain_google_genai import ChatGoogleGenerativeAI # Use LangChain's wrapper for Gemini
+    llm = ChatGoogleGenerativeAI(model="gemini-1.5-flash-latest", google_api_key=GOOGLE_API_KEY, convert_system_message_to_human=True)
+    return llm.bind_tools(tools)
+llm_component = LazyComponent("LLM", make_llm, INIT_RETRY_BASE_SECONDS, INIT_RETRY_MAX_SECONDS)
 
 # --- System Prompt (Keep the refined version from previous step) ---
 system_prompt = f"""You are a helpful assistant managing a GitHub repository ({GITHUB_REPO_NAME} on branch {GITHUB_BRANCH}) using tools.
 
 Available Tools:
-- list_github_files(directory_path): Shows files/dirs in a path (root if "").
+- search_github_files(query, limit): Finds files by fuzzy filename/path or by words in docs/ markdown. Returns ranked full paths with snippets.
+- list_github_files(directory_path): Recursively lists every file under a path (root if ""), with its size and blob sha.
 - read_github_file(file_path): Reads a file's content using FULL path. Returns 'Error: File not found...' if path is invalid.
+- get_file_outline(file_path): Returns the file's size, line count and headings with line numbers. Use it before reading large files (e.g. HTML pages under docs/research/).
+- read_github_file_range(file_path, start, end, unit, heading): Reads only part of a file: a line range (default), a byte range (unit='bytes'), or the section under a heading (heading='...'). Prefer it whenever you need just one section.
 - write_github_file(file_path, content, commit_message): Creates/Overwrites a file with FULL path, CONTENT, and commit message.
 - update_file_section(file_path, target_section_identifier, new_content_for_section, commit_message): Updates a SINGLE line in an existing file. Requires full path, identifier on the line, the new full line content, and commit message.
+- patch_github_file(file_path, edits, commit_message): Applies MANY line edits to one existing file at once. Each edit has `op` (replace/insert_before/insert_after/delete), `anchor` (text on the target line), optional `end_anchor` (last line of a range), `content` (new lines) and optional `occurrence`.
 
 *** Key Procedures ***
 
 1.  **File Paths:** ALWAYS use full paths from the repository root (e.g., 'docs/ingredients/argan_oil.md'). Add the `.md` extension for structured content files unless specified otherwise.
 2.  **Finding Files (CRITICAL):**
     *   When asked to read/write/update a file and the user provides only a filename (e.g., "read test3.md") or an ambiguous path:
-        a.  **First, TRY** the most likely path based on file type (see Directory Structure below) or user context. Call the appropriate tool (e.g., `read_github_file('docs/ingredients/test3.md')`).
+        a.  **First, call `search_github_files`** with the name the user gave (e.g., `search_github_files('test3')`). If the top result is clearly the file, use its full path directly. Otherwise **TRY** the most likely path based on file type (see Directory Structure below) or user context (e.g., `read_github_file('docs/ingredients/test3.md')`).
         b.  **If the tool returns an error message containing 'Error: File not found'**: This means your path guess was wrong or the file doesn't exist there. **DO NOT immediately ask the user for the path.**
         c.  **Instead, your VERY NEXT action MUST be** to call `list_github_files()` (or `list_github_files('relevant_directory/')` if you have a good guess which directory it *might* be in).
         d.  **Examine the list of files returned by `list_github_files`.** Search for the filename the user requested (e.g., 'test3.md').
@@ -181,12 +1360,12 @@ Available Tools:
         - You (Agent): Try likely path -> call `read_github_file(file_path='docs/ingredients/test3.md')`
         - Tool Result: "Error: File not found at 'docs/ingredients/test3.md'..."
         - You (Agent): File not found, must list files -> call `list_github_files(directory_path='')`
-        - Tool Result: `['README.md', 'docs/ingredients/test3.md', 'src/utils.py']` (stringified JSON)
+        - Tool Result: `[{{"path": "README.md", ...}}, {{"path": "docs/ingredients/test3.md", ...}}]` (stringified JSON)
         - You (Agent): Found unique match `docs/ingredients/test3.md` -> call `read_github_file(file_path='docs/ingredients/test3.md')`
         - Tool Result: (File content)
         - You (Agent): Respond to user with the content.
 
-3.  **Commit Messages:** For `write_github_file` or `update_file_section`, if the user doesn't provide one, GENERATE a concise message (e.g., "feat: Add [filename]", "docs: Update [filename]").
+3.  **Commit Messages:** For `write_github_file` or `update_file_section`, if the user doesn't provide one, GENERATE a concise message (e.g., "feat: Add [filename]", "docs: Update [filename]"). All writes made while answering one request are published together as a single commit when you finish; reading a file you already wrote returns your new content.
 4.  **Creating NEW Structured Files:**
     a.  Identify Type & Name -> Filename (always `.md`).
     b.  Determine Directory using this structure: Ingredients -> `{DIRECTORY_STRUCTURE['ingredient']}`, Formulations -> `{DIRECTORY_STRUCTURE['formulation']}`, Test Results -> `{DIRECTORY_STRUCTURE['test_result']}`, Other -> `{DIRECTORY_STRUCTURE['default']}`. Construct the FULL path.
@@ -196,11 +1375,19 @@ Available Tools:
     f.  Confirm success/failure to user.
 
 5.  **Updating Sections (`update_file_section`):** Use ONLY for modifying a specific line. Provide unique text from the target line as `target_section_identifier`, and the complete new line content as `new_content_for_section`. Generate commit message.
+    *   When changing MORE THAN ONE line or section of the same file, use ONE `patch_github_file` call with all edits instead of several `update_file_section` calls. If it reports a failed edit, fix only that edit's anchor and resend the batch.
 6.  **Clarity:** Confirm actions, present results/content clearly. Report errors.
 """
 
+def merge_known_files(known: Optional[Dict[str, str]], learned: Optional[Dict[str, str]]) -> Dict[str, str]:
+    """ {path: blob sha} reducer: newest entries last, capped at SESSION_KNOWN_FILES. """
+    merged = dict(known or {})
+    for path, sha in (learned or {}).items(): merged.pop(path, None); merged[path] = sha
+    return dict(list(merged.items())[-SESSION_KNOWN_FILES:])
+
 class AgentState(TypedDict):
     messages: Annotated[Sequence[BaseMessage], operator.add]
+    known_files: Annotated[Dict[str, str], merge_known_files] # Paths this session resolved, persisted across turns by the checkpointer
 
 # Agent Nodes (call_model, call_tool, should_continue) - Keep implementations from previous step
 # Ensure they handle system prompt injection and stringifying tool output correctly.
@@ -209,57 +1396,168 @@ def should_continue(state: AgentState) -> str:
     messages = state['messages']
     last_message = messages[-1]
     if isinstance(last_message, AIMessage) and not getattr(last_message, "tool_calls", None):
-        print("--- Agent Decision: Last message is AI response without tool calls, finishing ---")
+        logger.debug("--- Agent Decision: Last message is AI response without tool calls, finishing ---")
         return "end"
-    print("--- Agent Decision: Tool call requested or tool result received, continuing ---")
+    logger.debug("--- Agent Decision: Tool call requested or tool result received, continuing ---")
     return "continue"
 
+def estimate_tokens(message: BaseMessage) -> int:
+    """ Cheap prompt-size estimate (~4 chars per token), including tool-call arguments. """
+    chars = len(message.content) if isinstance(message.content, str) else len(json.dumps(message.content, default=str))
+    for tool_call in getattr(message, "tool_calls", None) or []: chars += len(json.dumps(tool_call.get("args", {}), default=str))
+    return chars // 4 + 4
+
+def compact_messages(messages: Sequence[BaseMessage], budget: int, keep_recent: int) -> List[BaseMessage]:
+    """ Replaces the oldest ToolMessage bodies with short stubs (tool, path, sha) until the estimate fits the budget; if the newest
+        keep_recent results alone are over it, cuts those to a head instead. State itself is untouched. """
+    compacted = list(messages); total = sum(estimate_tokens(m) for m in compacted)
+    if total <= budget: return compacted
+    calls = {tc.get("id"): tc for m in compacted if isinstance(m, AIMessage) for tc in (m.tool_calls or [])}
+    tool_indexes = [i for i, m in enumerate(compacted) if isinstance(m, ToolMessage)]
+    for i in tool_indexes[:max(len(tool_indexes) - keep_recent, 0)]:
+        if total <= budget: break
+        msg = compacted[i]; info = msg.additional_kwargs or {}; call = calls.get(msg.tool_call_id, {})
+        tool_name = info.get("tool_name") or call.get("name", "tool"); args = call.get("args", {})
+        target = info.get("path") or args.get("file_path") or args.get("directory_path", "")
+        sha = f" @ {info['sha'][:7]}" if info.get("sha") else ""
+        stub = ToolMessage(content=f"[Compacted earlier result of {tool_name}('{target}'){sha}, {len(msg.content)} chars. Call the tool again if you need it.]",
+                           tool_call_id=msg.tool_call_id, additional_kwargs=info)
+        total -= estimate_tokens(msg) - estimate_tokens(stub); compacted[i] = stub
+    # Still over: the recent results alone exceed the budget, so cut them (oldest first) down to a head that fits
+    for i in tool_indexes[max(len(tool_indexes) - keep_recent, 0):]:
+        if total <= budget: break
+        msg = compacted[i]; info = msg.additional_kwargs or {}
+        if not isinstance(msg.content, str) or len(msg.content) <= COMPACT_MIN_KEPT_CHARS: continue
+        note = f"\n[... cut at {{}} of {len(msg.content)} characters to fit the context budget. Use read_github_file_range for the rest.]"
+        keep = max(len(msg.content) - (total - budget) * 4 - len(note) - 8, COMPACT_MIN_KEPT_CHARS)
+        cut = ToolMessage(content=msg.content[:keep] + note.format(keep), tool_call_id=msg.tool_call_id, additional_kwargs=info)
+        total -= estimate_tokens(msg) - estimate_tokens(cut); compacted[i] = cut
+    return compacted
+
+llm_slots = threading.BoundedSemaphore(LLM_CONCURRENCY)
+
+# Per-run callback receiving the model's text deltas as they stream in (set by execute_agent_run)
+_token_sink: contextvars.ContextVar = contextvars.ContextVar("token_sink", default=None)
+
+# Static prefix: built and measured once, reused on every step
+system_message = SystemMessage(content=system_prompt)
+SYSTEM_PROMPT_TOKENS = estimate_tokens(system_message)
+
+def session_system_message(known_files: Dict[str, str]) -> SystemMessage:
+    """ The system prompt plus the paths this session already resolved, so follow-up turns skip search/list round trips. """
+    if not known_files: return system_message
+    bot = github_component.peek()
+    lines = [f"- {path} @ {((bot.known_sha(path) if bot else None) or sha or 'uncommitted')[:7]}" for path, sha in known_files.items()]
+    return SystemMessage(content=system_prompt + "\n\nFiles already located in this conversation (full path @ blob sha). Use these paths directly instead of searching or listing again:\n" + "\n".join(lines))
+
+@traced("node", "agent")
 def call_model(state: AgentState):
     messages = state['messages']
-    print(f"\n--- Node: Agent (Calling LLM) ---")
-    messages_with_system_prompt = [SystemMessage(content=system_prompt)] + messages
-    print(f"Messages sent to LLM: {[m.type for m in messages_with_system_prompt]}")
+    logger.info(f"--- Node: Agent (Calling LLM) ---")
+    system = session_system_message(state.get('known_files'))
+    system_tokens = SYSTEM_PROMPT_TOKENS if system is system_message else estimate_tokens(system)
+    history = compact_messages(messages, CONTEXT_TOKEN_BUDGET - system_tokens, CONTEXT_KEEP_RECENT_TOOL_RESULTS)
+    messages_with_system_prompt = [system] + history
+    full_tokens = system_tokens + sum(estimate_tokens(m) for m in messages)
+    sent_tokens = system_tokens + sum(estimate_tokens(m) for m in history)
+    logger.debug(f"Messages sent to LLM: {[m.type for m in messages_with_system_prompt]}")
+    logger.info(f"Prompt tokens (est.): {sent_tokens} sent / {full_tokens} uncompacted (budget {CONTEXT_TOKEN_BUDGET})")
     try:
-        response = llm_with_tools.invoke(messages_with_system_prompt)
-        print(f"LLM Response Type: {type(response)}")
-        if hasattr(response, 'content'): print(f"LLM Content (trunc): {response.content[:100]}...")
-        if hasattr(response, 'tool_calls') and response.tool_calls: print(f"LLM Tool Calls: {response.tool_calls}")
+        sink = _token_sink.get(); response = None
+        with llm_slots, span("llm", "gemini") as llm_fields: # Slots bound concurrent Gemini calls across runs
+            for chunk in llm_component.get().stream(messages_with_system_prompt):
+                response = chunk if response is None else response + chunk
+                if sink and isinstance(chunk.content, str) and chunk.content: sink(chunk.content)
+            response = message_chunk_to_message(response) if response is not None else AIMessage(content="")
+            usage = getattr(response, 'usage_metadata', None) or {}
+            llm_fields["prompt_tokens"] = usage.get('input_tokens', sent_tokens); llm_fields["completion_tokens"] = usage.get('output_tokens', estimate_tokens(response))
+        metrics.inc("github_auto_llm_tokens_total", llm_fields["prompt_tokens"], type="prompt")
+        metrics.inc("github_auto_llm_tokens_total", llm_fields["completion_tokens"], type="completion")
+        if usage: logger.info(f"Prompt tokens (reported): {usage.get('input_tokens')}, completion: {usage.get('output_tokens')}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"LLM Response Type: {type(response)}")
+            if hasattr(response, 'content'): logger.debug(f"LLM Content (trunc): {response.content[:100]}...")
+            if hasattr(response, 'tool_calls') and response.tool_calls: logger.debug(f"LLM Tool Calls: {response.tool_calls}")
         return {"messages": [response]}
     except Exception as e:
-         print(f"LLM Invocation Error: {e}"); traceback.print_exc()
+         logger.exception(f"LLM Invocation Error: {e}")
          error_response = AIMessage(content=f"Error invoking LLM: {e}")
          return {"messages": [error_response]} # Return error as AI message
 
+def _invoke_tool(selected_tool, tool_name: str, tool_args: dict, wait_for=()) -> tuple:
+    """ Runs one tool call (after the same-path calls it depends on, if any); returns (stringified result, latency in ms). """
+    for predecessor in wait_for:
+        try: predecessor.result()
+        except Exception: pass # Predecessor's own error is reported on its own ToolMessage
+    if logger.isEnabledFor(logging.DEBUG): logger.debug(f"Invoking tool: {tool_name} with args: {tool_args}")
+    started = time.perf_counter(); status = "ok"
+    try:
+        response_content = selected_tool.invoke(tool_args)
+        if not isinstance(response_content, str):
+            logger.debug(f"Tool type {type(response_content)}. Stringify.")
+            try: stringified_content = json.dumps(response_content, indent=2)
+            except TypeError: stringified_content = str(response_content)
+        else: stringified_content = response_content
+        if logger.isEnabledFor(logging.DEBUG): logger.debug(f"Tool Response (stringified): {stringified_content[:500]}...") # Truncate long responses in log
+        if stringified_content.startswith(("Error", "ERR")) or '"ERR' in stringified_content[:10]: status = "error"
+    except Exception as e:
+        logger.exception(f"Error executing tool {tool_name}: {e}")
+        stringified_content = f"Error tool {tool_name}: {e}"; status = "exception"
+    elapsed = time.perf_counter() - started
+    record_span("tool", tool_name, elapsed, status=status); metrics.inc("github_auto_tool_calls_total", tool=tool_name, status=status)
+    return stringified_content, elapsed * 1000
+
+@traced("node", "action")
 def call_tool(state: AgentState):
     messages = state['messages']
     last_message = messages[-1]
     if not isinstance(last_message, AIMessage) or not hasattr(last_message, 'tool_calls') or not last_message.tool_calls:
-         print("--- Node: Tool Executor - Warning: Last message no tool calls. Skip.")
+         logger.warning("--- Node: Tool Executor - Warning: Last message no tool calls. Skip.")
          return {}
-    print(f"\n--- Node: Tool Executor ---"); print(f"Executing tool calls: {last_message.tool_calls}")
-    tool_messages = []
+    logger.info(f"--- Node: Tool Executor ---")
+    if logger.isEnabledFor(logging.DEBUG): logger.debug(f"Executing tool calls: {last_message.tool_calls}")
+    # Submit every call to the shared pool. Reads of a path run concurrently after the last write to it; a write waits for every earlier call on it.
+    pending = []; last_write = {}; readers = {}; tool_paths = {}
     for tool_call in last_message.tool_calls:
         tool_name = tool_call.get('name'); tool_args = tool_call.get('args', {}); tool_call_id = tool_call.get('id')
-        if not tool_name or not tool_call_id: print(f"Skip invalid tool: {tool_call}"); continue
+        if not tool_name or not tool_call_id: logger.info(f"Skip invalid tool: {tool_call}"); continue
         selected_tool = next((t for t in tools if t.name == tool_name), None)
         if not selected_tool:
-             print(f"Error: Tool '{tool_name}' not found.")
-             tool_messages.append(ToolMessage(content=f"Error: Tool '{tool_name}' unavailable.", tool_call_id=tool_call_id))
-             continue
-        print(f"Invoking tool: {tool_name} with args: {tool_args}")
-        try:
-            response_content = selected_tool.invoke(tool_args)
-            if not isinstance(response_content, str):
-                print(f"Tool type {type(response_content)}. Stringify.")
-                try: stringified_content = json.dumps(response_content, indent=2)
-                except TypeError: stringified_content = str(response_content)
-            else: stringified_content = response_content
-            print(f"Tool Response (stringified): {stringified_content[:500]}...") # Truncate long responses in log
-            tool_messages.append(ToolMessage(content=stringified_content, tool_call_id=tool_call_id))
-        except Exception as e:
-            print(f"Error executing tool {tool_name}: {e}"); traceback.print_exc()
-            tool_messages.append(ToolMessage(content=f"Error tool {tool_name}: {e}", tool_call_id=tool_call_id))
-    return {"messages": tool_messages}
+             logger.error(f"Error: Tool '{tool_name}' not found.")
+             pending.append((tool_name, tool_call_id, None, None)); continue
+        path = tool_args.get('file_path'); is_write = tool_name not in READ_ONLY_TOOLS
+        wait_for = [last_write[path]] if path in last_write else []
+        if path and is_write: wait_for += readers.pop(path, [])
+        # Copy the context so the run's write session follows the call into the worker thread; writes also carry a timeout guard
+        ctx = contextvars.copy_context(); guard = ToolCallGuard() if is_write else None
+        if guard is not None: ctx.run(_tool_call_guard.set, guard)
+        future = tool_pool.submit(ctx.run, _invoke_tool, selected_tool, tool_name, tool_args, wait_for)
+        if path:
+            tool_paths[tool_call_id] = path
+            if is_write: last_write[path] = future
+            else: readers.setdefault(path, []).append(future)
+        pending.append((tool_name, tool_call_id, future, guard))
+    tool_messages = []; learned = {}
+    for tool_name, tool_call_id, future, guard in pending: # Collected in the original tool_call order
+        if future is None:
+            tool_messages.append(ToolMessage(content=f"Error: Tool '{tool_name}' unavailable.", tool_call_id=tool_call_id)); continue
+        timeout = TOOL_TIMEOUTS.get(tool_name, TOOL_TIMEOUT_SECONDS)
+        try: content, latency_ms = future.result(timeout=timeout)
+        except FuturesTimeoutError:
+            if guard is not None and not guard.abandon(): # The write was already being applied; its outcome is the real result
+                logger.warning(f"Tool {tool_name} passed its {timeout}s timeout while applying a write; waiting for it.")
+                content, latency_ms = future.result()
+            else:
+                logger.error(f"Error: Tool {tool_name} timed out after {timeout}s.")
+                note = " The write was not applied." if guard is not None else ""
+                content, latency_ms = f"Error tool {tool_name}: timed out after {timeout}s.{note}", timeout * 1000
+        tool_info = {"tool_name": tool_name, "latency_ms": round(latency_ms, 1)}
+        path = tool_paths.get(tool_call_id)
+        github_bot = github_component.peek()
+        if path: tool_info["path"] = path; tool_info["sha"] = github_bot.known_sha(path) if github_bot else None # Lets compaction name what was elided
+        if path and not content.startswith(("Error", "ERR", '{"error"', '{\n  "error"')): learned[path] = tool_info["sha"]
+        tool_messages.append(ToolMessage(content=content, tool_call_id=tool_call_id, additional_kwargs=tool_info))
+    return {"messages": tool_messages, "known_files": learned}
 
 
 # === 5. Define the LangGraph Workflow (Same as before) ===
@@ -269,13 +1567,253 @@ workflow.add_node("action", call_tool)
 workflow.set_entry_point("agent")
 workflow.add_conditional_edges("agent", should_continue, {"continue": "action", "end": END})
 workflow.add_edge("action", "agent")
-try:
-    langgraph_agent_app = workflow.compile()
-    print("--- LangGraph Agent Compiled ---")
-except Exception as compile_error: print(f"FATAL: LangGraph compile failed: {compile_error}"); langgraph_agent_app = None
+agent_component = LazyComponent("LangGraph Agent", workflow.compile, INIT_RETRY_BASE_SECONDS, INIT_RETRY_MAX_SECONDS)
+# Same graph with state checkpointed per session id, for multi-turn conversations
+session_agent_component = LazyComponent("LangGraph Session Agent", lambda: workflow.compile(checkpointer=session_store), INIT_RETRY_BASE_SECONDS, INIT_RETRY_MAX_SECONDS)
+COMPONENTS = [github_component, llm_component, agent_component, session_agent_component]
+
+_warm_up_lock = threading.Lock()
+def warm_up() -> None:
+    """ Initializes every idle (or retry-due) component in a background thread; never blocks the caller. """
+    def run():
+        for component in COMPONENTS:
+            try: component.get()
+            except ComponentUnavailable: pass # Already logged; retried on next use or next warm_up()
+        _warm_up_lock.release()
+    if _warm_up_lock.acquire(blocking=False): threading.Thread(target=run, name="warm-up", daemon=True).start()
+
+if WARMUP_ON_START: warm_up()
 
 
 # === 6. Flask Application - SSE Implementation ===
+class AgentRun:
+    """ One agent execution decoupled from any HTTP connection. Events are numbered and retained so a reconnecting
+        client (SSE Last-Event-ID) can replay what it missed and keep tailing without re-running the agent. """
+    def __init__(self, prompt: str):
+        self.run_id = uuid.uuid4().hex[:12]; self.prompt = prompt
+        self.events: List[tuple] = [] # (seq, payload)
+        self.done = False; self.finished_at: Optional[float] = None
+        self.cancelled = threading.Event(); self.subscribers = 0; self.future = None
+        self._cond = threading.Condition()
+
+    def cancel_if_unwatched(self) -> None:
+        """ Called after the disconnect grace period: stop the run if no client has reconnected. """
+        with self._cond:
+            if self.subscribers or self.done: return
+        logger.info(f"--- Agent Run {self.run_id}: client gone, cancelling ---"); self.cancelled.set()
+        if self.future is not None and self.future.cancel(): agent_pool.discard_queued(self) # Never started
+
+    def emit(self, payload: dict) -> None:
+        with self._cond: self.events.append((len(self.events) + 1, payload)); self._cond.notify_all()
+
+    def finish(self) -> None:
+        with self._cond: self.done = True; self.finished_at = time.monotonic(); self._cond.notify_all()
+
+    def wait_for(self, after_seq: int, timeout: float) -> List[tuple]:
+        """ Events newer than `after_seq`, waiting up to `timeout` for the first one. """
+        with self._cond:
+            if len(self.events) <= after_seq and not self.done: self._cond.wait(timeout)
+            return self.events[after_seq:]
+
+
+_runs: Dict[str, AgentRun] = {}
+_runs_lock = threading.Lock()
+
+def register_run(run: AgentRun) -> None:
+    with _runs_lock:
+        now = time.monotonic() # Drop finished runs past retention, then the oldest finished ones over the cap
+        for run_id in [r.run_id for r in _runs.values() if r.done and now - r.finished_at > RUN_RETENTION_SECONDS]: del _runs[run_id]
+        finished = sorted((r for r in _runs.values() if r.done), key=lambda r: r.finished_at)
+        for old in finished[:max(len(_runs) - RUN_REGISTRY_SIZE + 1, 0)]: del _runs[old.run_id]
+        _runs[run.run_id] = run
+
+_session_runs: Dict[str, AgentRun] = {} # session id -> its latest run; one turn per session at a time
+SESSION_ID_PATTERN = re.compile(r"[A-Za-z0-9_.:-]{1,128}")
+
+def claim_session(session_id: str, run: AgentRun) -> bool:
+    """ Binds `run` to the session unless another turn of it is still running. """
+    with _runs_lock:
+        for finished in [sid for sid, r in _session_runs.items() if r.done]: del _session_runs[finished]
+        if session_id in _session_runs: return False
+        _session_runs[session_id] = run; return True
+
+def find_run(last_event_id: Optional[str]) -> tuple:
+    """ Parses an SSE event id ('<run_id>:<seq>') into (run or None, seq). """
+    run_id, _, seq = (last_event_id or "").partition(":")
+    with _runs_lock: run = _runs.get(run_id)
+    return run, int(seq) if seq.isdigit() else 0
+
+def stream_run_events(run: AgentRun, after_seq: int = 0):
+    """ SSE generator: every event carries an id; comment heartbeats keep idle proxies from cutting the connection.
+        When the last subscriber disconnects, the run is cancelled unless a client resumes within the grace period. """
+    with run._cond: run.subscribers += 1
+    try:
+        yield f"retry: {SSE_RETRY_MS}\n\n"
+        while True:
+            events = run.wait_for(after_seq, SSE_HEARTBEAT_SECONDS)
+            for seq, payload in events: yield f"id: {run.run_id}:{seq}\ndata: {json.dumps(payload)}\n\n"
+            if events: after_seq = events[-1][0]
+            elif run.done: return
+            else: yield ": heartbeat\n\n"
+    finally:
+        with run._cond: run.subscribers -= 1; unwatched = not run.subscribers and not run.done
+        if unwatched: threading.Timer(RUN_DISCONNECT_GRACE_SECONDS, run.cancel_if_unwatched).start()
+
+
+class RunCancelled(Exception):
+    """ Raised between graph steps once a run's client has gone away. """
+
+
+class AgentRunPool:
+    """ Bounded executor for agent runs. Admission fails fast (see sse_refusal) once AGENT_QUEUE_DEPTH runs are waiting for a worker. """
+    def __init__(self, workers: int, max_queued: int):
+        self.max_queued = max_queued; self.queued = 0; self.active = 0; self.rejected = 0
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="agent")
+        self.workers = workers; self._lock = threading.Lock()
+
+    def submit(self, run: AgentRun, fn, *args) -> bool:
+        with self._lock:
+            if self.queued >= self.max_queued: self.rejected += 1; return False
+            self.queued += 1
+        # Copy the context so per-run context variables set by the caller follow the run into the worker
+        run.future = self._executor.submit(contextvars.copy_context().run, self._run, run, fn, *args)
+        return True
+
+    def _run(self, run: AgentRun, fn, *args) -> None:
+        with self._lock: self.queued -= 1; self.active += 1
+        try:
+            if run.cancelled.is_set(): run.finish(); return
+            fn(run, *args)
+        finally:
+            with self._lock: self.active -= 1
+
+    def discard_queued(self, run: AgentRun) -> None:
+        with self._lock: self.queued -= 1
+        run.finish()
+
+    def stats(self) -> dict:
+        with self._lock: return {"workers": self.workers, "active": self.active, "queued": self.queued, "max_queued": self.max_queued, "rejected": self.rejected}
+
+
+agent_pool = AgentRunPool(AGENT_WORKERS, AGENT_QUEUE_DEPTH)
+
+def execute_agent_run(run: "AgentRun", prompt: str, langgraph_agent_app, github_bot: Optional[Github_Auto], session_id: Optional[str] = None) -> None:
+    """ Runs the graph for one prompt, publishing status/log/token/complete events on `run` (runs on a background thread).
+        With a session id the graph continues that session's checkpointed state; a cancelled or failed turn, or one whose commit failed, is rolled back. """
+    token_sink = _token_sink.set(lambda delta: run.emit({"type": "token", "delta": delta}))
+    timings = RunTimings(); run_timings = _run_timings.set(timings)
+    rollback = session_store.snapshot(session_id) if session_id else None
+    try:
+        logger.info(f"--- Agent Run {run.run_id} Started for prompt: {prompt[:50]}... ---")
+        inputs = {"messages": [HumanMessage(content=prompt)]}
+        final_state_messages = [] # Store messages to extract final response
+        commit_result = None
+        recursion_depth = 0
+        max_recursion = 30
+        config = {"recursion_limit": max_recursion}
+        if session_id: config["configurable"] = {"thread_id": session_id}
+
+        # Buffer all writes of this run; they are published as one commit after the graph finishes
+        write_session = github_bot.write_session() if github_bot else nullcontext(None)
+        with write_session as session:
+            # Stream the graph execution
+            for event in langgraph_agent_app.stream(inputs, config):
+                recursion_depth += 1
+                if run.cancelled.is_set(): raise RunCancelled()
+                # print(f"DEBUG SSE Event: {event}")
+
+                status_update = {"type": "status", "message": "Processing..."}
+                log_event_simple = {"type": "log", "data": "Step executed."} # Default log
+                node_name = list(event.keys())[0]
+                log_event_simple["data"] = f"Node '{node_name}' running..." # Update log
+
+
+                if node_name == 'agent':
+                     status_update["message"] = "Agent: Thinking..."
+                     agent_output = event.get('agent', {})
+                     messages = agent_output.get('messages', [])
+                     if messages:
+                         last_msg = messages[-1]
+                         if isinstance(last_msg, AIMessage):
+                             if getattr(last_msg, 'tool_calls', None):
+                                 tool_names = [tc['name'] for tc in last_msg.tool_calls]
+                                 status_update["message"] = f"Agent: Requesting tool(s) - {', '.join(tool_names)}"
+                                 log_event_simple["data"] = f"Agent requesting tools: {', '.join(tool_names)}"
+                             else:
+                                 status_update["message"] = "Agent: Formulating final response..."
+                                 log_event_simple["data"] = "Agent formulating final response."
+
+                elif node_name == 'action':
+                     status_update["message"] = "Action: Processing tool results..."
+                     log_event_simple["data"] = "Action node processing results."
+                     action_output = event.get('action', {})
+                     messages = action_output.get('messages', [])
+                     if messages:
+                         tool_msgs_summary = []
+                         for msg in messages:
+                              if isinstance(msg, ToolMessage):
+                                  content_summary = msg.content[:100] + ('...' if len(msg.content)>100 else '')
+                                  tool_info = msg.additional_kwargs or {}
+                                  timing = f" {tool_info.get('tool_name', '')} {tool_info['latency_ms']}ms" if 'latency_ms' in tool_info else ""
+                                  tool_msgs_summary.append(f"Tool Result ({msg.tool_call_id[:6]}{timing}): {content_summary}")
+                         if tool_msgs_summary:
+                              status_update["message"] = "; ".join(tool_msgs_summary)
+                              latencies = [f"{(m.additional_kwargs or {}).get('tool_name', '?')}={(m.additional_kwargs or {}).get('latency_ms', '?')}ms" for m in messages if isinstance(m, ToolMessage)]
+                              log_event_simple["data"] = f"Tool results processed: {len(tool_msgs_summary)} message(s). Latency: {', '.join(latencies)}"
+
+
+                run.emit(status_update)
+                run.emit(log_event_simple)
+
+                # Update message history
+                node_output = event[node_name]
+                if isinstance(node_output, dict) and 'messages' in node_output:
+                    final_state_messages.extend(node_output['messages'])
+
+            if session is not None: session.close() # Writes still in flight (timed-out tool calls) must not slip in after this point
+            commit_result = github_bot.commit_session(session) if session is not None else None
+            if commit_result:
+                run.emit({'type': 'status', 'message': commit_result})
+                run.emit({'type': 'log', 'data': f'Run commit: {commit_result}'})
+            if session_id and commit_result and commit_result.startswith("ERR"):
+                # The checkpoint would otherwise keep "Staged" successes and known_files entries for writes that never landed
+                session_store.restore(session_id, rollback); logger.warning(f"Session {session_id}: commit failed, turn rolled back.")
+                run.emit({'type': 'log', 'data': 'Commit failed; this turn was not kept in the conversation.'})
+
+        # --- Stream finished ---
+        logger.info("--- SSE Stream: Graph execution finished ---")
+        final_response_content = "Agent finished, but no final response found."
+        if final_state_messages:
+            final_ai_message = None
+            for msg in reversed(final_state_messages):
+                if isinstance(msg, AIMessage) and not getattr(msg, 'tool_calls', None):
+                    final_ai_message = msg; break
+            if final_ai_message: final_response_content = final_ai_message.content
+            else:
+                last_msg = final_state_messages[-1]
+                final_response_content = f"Agent finished. Last step result ({last_msg.type}): {last_msg.content}"
+                logger.warning(f"Warn: Agent loop end no final AIMessage. Last: {last_msg}")
+
+        completion_event = {"type": "complete", "final_response": final_response_content, "commit": commit_result, "timings": timings.summary(), "session_id": session_id}
+        metrics.inc("github_auto_runs_total", outcome="complete")
+        run.emit(completion_event)
+        logger.info(f"--- Agent Run {run.run_id}: Sent completion event. ---")
+
+    except RunCancelled:
+        logger.info(f"--- Agent Run {run.run_id}: Cancelled; staged writes discarded. ---")
+        if session_id: session_store.restore(session_id, rollback)
+        run.emit({"type": "error", "message": "Agent run cancelled."}); metrics.inc("github_auto_runs_total", outcome="cancelled")
+    except Exception as e:
+        logger.exception(f"Error during agent stream processing: {e}"); metrics.inc("github_auto_runs_total", outcome="error")
+        if session_id: session_store.restore(session_id, rollback)
+        error_event = {"type": "error", "message": f"An error occurred during processing: {type(e).__name__}"}
+        # Send the error back to the client via SSE
+        run.emit(error_event)
+
+    finally:
+        _token_sink.reset(token_sink); _run_timings.reset(run_timings); run.finish()
+
+
 flask_app = Flask(__name__)
 flask_app.secret_key = os.urandom(24) # For flashing messages (optional)
 
@@ -284,135 +1822,154 @@ flask_app.secret_key = os.urandom(24) # For flashing messages (optional)
 # SSE route to stream agent execution
 @flask_app.route('/', methods=['GET'])
 def index():
-    github_enabled = github_bot is not None and tools
-    agent_ready = langgraph_agent_app is not None
+    github_enabled = github_component.state != "failed" and tools
+    agent_ready = agent_component.state != "failed" and llm_component.state != "failed"
     return render_template('index.html',
                            prompt=None,
                            response=None,
                            github_enabled=github_enabled,
                            agent_ready=agent_ready)
 
+# Content cache counters, for tuning CONTENT_CACHE_BYTES
+@flask_app.route('/cache_stats', methods=['GET'])
+def cache_stats():
+    github_bot = github_component.peek()
+    if not github_bot: return jsonify({"error": "GitHub bot not initialized."}), 503
+    return jsonify(github_bot.content_cache.stats())
+
+# GitHub transport counters: per-endpoint calls/latency/304s and the remaining rate-limit budget (git backend: mirror/push state)
+@flask_app.route('/github_stats', methods=['GET'])
+def github_stats():
+    github_bot = github_component.peek()
+    if not github_bot: return jsonify({"error": "GitHub bot not initialized."}), 503
+    return jsonify(github_bot.transport.stats() if github_bot.transport else github_bot.stats())
+
+# Session store occupancy, for sizing SESSION_STORE_BYTES / SESSION_TTL_SECONDS
+@flask_app.route('/session_stats', methods=['GET'])
+def session_stats():
+    return jsonify(session_store.stats())
+
+# Forget a conversation (the client starts a new one)
+@flask_app.route('/sessions/<session_id>', methods=['DELETE'])
+def delete_session(session_id):
+    session_store.delete_thread(session_id)
+    return jsonify({"deleted": session_id})
+
+# Liveness: the process is up and serving requests
+@flask_app.route('/healthz', methods=['GET'])
+def healthz():
+    return jsonify({"status": "ok"})
+
+# Readiness: every component is initialized; kicks a background warm-up otherwise
+@flask_app.route('/readyz', methods=['GET'])
+def readyz():
+    components = {component.name: component.status() for component in COMPONENTS}
+    ready = all(component.state == "ready" for component in COMPONENTS)
+    if not ready: warm_up()
+    return jsonify({"ready": ready, "components": components}), 200 if ready else 503
+
+def sse_refusal(message: str, status: int, retry_after: Optional[int] = None) -> Response:
+    """ A refused /agent_stream request. EventSource (Accept: text/event-stream) drops the body of any non-200 response, so it
+        gets the error event with 200; other clients get the real status, plus Retry-After for 429/503. """
+    body = f"data: {json.dumps({'type': 'error', 'message': message})}\n\n"
+    if "text/event-stream" in request.headers.get("Accept", ""): return Response(body, mimetype='text/event-stream')
+    return Response(body, mimetype='text/event-stream', status=status, headers={"Retry-After": str(retry_after)} if retry_after else None)
+
 # SSE route to stream agent execution
 @flask_app.route('/agent_stream')
 def agent_stream():
     # Wrap the entire stream logic setup in a try block to ensure a response is returned
     try:
+        # Reconnect (EventSource sends Last-Event-ID): replay missed events of the existing run instead of re-running it
+        last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+        if last_event_id:
+            run, after_seq = find_run(last_event_id)
+            if run is None:
+                return Response(f"data: {json.dumps({'type': 'error', 'message': 'Agent run expired; please resend the prompt.'})}\n\n", mimetype='text/event-stream')
+            logger.info(f"SSE: Resuming run {run.run_id} after event {after_seq}.")
+            return Response(stream_run_events(run, after_seq), mimetype='text/event-stream', headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
         prompt = request.args.get('prompt', '') # Default to empty string if not provided
         if not prompt:
-            print("SSE Error: No prompt provided in request.")
+            logger.error("SSE Error: No prompt provided in request.")
             # Immediately return an error response
             return Response(f"data: {json.dumps({'type': 'error', 'message': 'No prompt provided.'})}\n\n", mimetype='text/event-stream')
 
-        if not langgraph_agent_app:
-             print("SSE Error: Agent not initialized.")
+        session_id = request.args.get('session_id') or None # Multi-turn: the graph resumes this session's checkpointed state
+        if session_id and not SESSION_ID_PATTERN.fullmatch(session_id):
+            return sse_refusal("Invalid session id.", 400)
+        try: langgraph_agent_app = (session_agent_component if session_id else agent_component).get(); llm_component.get()
+        except ComponentUnavailable as e:
+             logger.error(f"SSE Error: Agent not initialized. {e}")
              # Immediately return an error response
-             return Response(f"data: {json.dumps({'type': 'error', 'message': 'Agent not initialized.'})}\n\n", mimetype='text/event-stream')
-
-        # Define the generator function *inside* the main function's scope
-        # or ensure it captures necessary variables if defined outside
-        def generate_sse_events():
-            try:
-                print(f"\n--- SSE Stream Started for prompt: {prompt[:50]}... ---")
-                inputs = {"messages": [HumanMessage(content=prompt)]}
-                final_state_messages = [] # Store messages to extract final response
-                recursion_depth = 0
-                max_recursion = 30
-
-                # Stream the graph execution
-                for event in langgraph_agent_app.stream(inputs, {"recursion_limit": max_recursion}):
-                    recursion_depth += 1
-                    # print(f"DEBUG SSE Event: {event}")
-
-                    status_update = {"type": "status", "message": "Processing..."}
-                    log_event_simple = {"type": "log", "data": "Step executed."} # Default log
-                    node_name = list(event.keys())[0]
-                    log_event_simple["data"] = f"Node '{node_name}' running..." # Update log
-
-
-                    if node_name == 'agent':
-                         status_update["message"] = "Agent: Thinking..."
-                         agent_output = event.get('agent', {})
-                         messages = agent_output.get('messages', [])
-                         if messages:
-                             last_msg = messages[-1]
-                             if isinstance(last_msg, AIMessage):
-                                 if getattr(last_msg, 'tool_calls', None):
-                                     tool_names = [tc['name'] for tc in last_msg.tool_calls]
-                                     status_update["message"] = f"Agent: Requesting tool(s) - {', '.join(tool_names)}"
-                                     log_event_simple["data"] = f"Agent requesting tools: {', '.join(tool_names)}"
-                                 else:
-                                     status_update["message"] = "Agent: Formulating final response..."
-                                     log_event_simple["data"] = "Agent formulating final response."
-
-                    elif node_name == 'action':
-                         status_update["message"] = "Action: Processing tool results..."
-                         log_event_simple["data"] = "Action node processing results."
-                         action_output = event.get('action', {})
-                         messages = action_output.get('messages', [])
-                         if messages:
-                             tool_msgs_summary = []
-                             for msg in messages:
-                                  if isinstance(msg, ToolMessage):
-                                      content_summary = msg.content[:100] + ('...' if len(msg.content)>100 else '')
-                                      tool_msgs_summary.append(f"Tool Result ({msg.tool_call_id[:6]}): {content_summary}")
-                             if tool_msgs_summary:
-                                  status_update["message"] = "; ".join(tool_msgs_summary)
-                                  log_event_simple["data"] = f"Tool results processed: {len(tool_msgs_summary)} message(s)."
-
-
-                    yield f"data: {json.dumps(status_update)}\n\n"
-                    yield f"data: {json.dumps(log_event_simple)}\n\n"
-
-                    # Update message history
-                    node_output = event[node_name]
-                    if isinstance(node_output, dict) and 'messages' in node_output:
-                        final_state_messages.extend(node_output['messages'])
-
-                # --- Stream finished ---
-                print("--- SSE Stream: Graph execution finished ---")
-                final_response_content = "Agent finished, but no final response found."
-                if final_state_messages:
-                    final_ai_message = None
-                    for msg in reversed(final_state_messages):
-                        if isinstance(msg, AIMessage) and not getattr(msg, 'tool_calls', None):
-                            final_ai_message = msg; break
-                    if final_ai_message: final_response_content = final_ai_message.content
-                    else:
-                        last_msg = final_state_messages[-1]
-                        final_response_content = f"Agent finished. Last step result ({last_msg.type}): {last_msg.content}"
-                        print(f"Warn: Agent loop end no final AIMessage. Last: {last_message}")
-
-                completion_event = {"type": "complete", "final_response": final_response_content}
-                yield f"data: {json.dumps(completion_event)}\n\n"
-                print(f"--- SSE Stream: Sent completion event. ---")
+             return sse_refusal("Agent not initialized.", 503, retry_after=10)
+        try: github_bot = github_component.get()
+        except ComponentUnavailable: github_bot = None # Tools report the GitHub error to the agent
 
-            except Exception as e:
-                print(f"Error during agent stream processing: {e}")
-                traceback.print_exc()
-                error_event = {"type": "error", "message": f"An error occurred during processing: {type(e).__name__}"}
-                # Yield the error back to the client via SSE
-                yield f"data: {json.dumps(error_event)}\n\n"
-
-        # *** Return the Response object wrapping the generator ***
-        return Response(generate_sse_events(), mimetype='text/event-stream')
+        # Run the agent on the bounded pool; the response only tails the run's events
+        run = AgentRun(prompt)
+        # First event, sent before the run can produce any: gives the browser a Last-Event-ID, so a drop while queued or during
+        # the first model call resumes this run instead of re-sending the prompt (a duplicate run, or a busy session)
+        run.emit({"type": "accepted", "run_id": run.run_id, "session_id": session_id})
+        if session_id and not claim_session(session_id, run):
+            return sse_refusal("This conversation is still running; wait for it to finish.", 409)
+        if not agent_pool.submit(run, execute_agent_run, prompt, langgraph_agent_app, github_bot, session_id):
+            logger.error("SSE Error: Agent queue full, rejecting prompt."); metrics.inc("github_auto_runs_total", outcome="rejected"); run.finish() # Releases the session
+            return sse_refusal("Server busy; please retry shortly.", 429, retry_after=5)
+        register_run(run)
+        return Response(stream_run_events(run), mimetype='text/event-stream', headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
     except Exception as e:
-        # Catch errors during the *initial setup* of the stream (before generate_sse_events starts)
-        print(f"Error setting up SSE stream: {e}")
-        traceback.print_exc()
+        # Catch errors during the *initial setup* of the stream (before the agent run starts)
+        logger.exception(f"Error setting up SSE stream: {e}")
         # Return an error response directly if setup fails
         # Ensure this is also a valid Response object
         error_msg = f"Failed to start agent stream: {type(e).__name__}"
         return Response(f"data: {json.dumps({'type': 'error', 'message': error_msg})}\n\n", mimetype='text/event-stream', status=500)
 
 
-# === 7. Run Flask App (Conditional) ===
+def _cache_gauge(key: str):
+    bot = github_component.peek(); return bot.content_cache.stats()[key] if bot else 0
+
+def _rate_limit_gauge():
+    bot = github_component.peek(); return bot.transport.stats()["rate_limit"]["remaining"] if bot and bot.transport else -1
+
+def _unpushed_gauge():
+    bot = github_component.peek(); return bot.unpushed() if isinstance(bot, LocalGitBackend) else 0
+
+metrics.gauge("github_auto_agent_runs_active", "Agent runs executing on the pool.", lambda: agent_pool.stats()["active"])
+metrics.gauge("github_auto_agent_runs_queued", "Agent runs waiting for a worker.", lambda: agent_pool.stats()["queued"])
+metrics.gauge("github_auto_content_cache_bytes", "Bytes held by the file content cache.", lambda: _cache_gauge("bytes_used"))
+metrics.gauge("github_auto_content_cache_hits", "Content cache hits since start.", lambda: _cache_gauge("hits"))
+metrics.gauge("github_auto_content_cache_misses", "Content cache misses since start.", lambda: _cache_gauge("misses"))
+metrics.gauge("github_auto_github_rate_limit_remaining", "Remaining GitHub API budget from the last response headers.",
+              _rate_limit_gauge)
+metrics.gauge("github_auto_git_unpushed_commits", "Local mirror commits not yet pushed (git backend).", _unpushed_gauge)
+metrics.gauge("github_auto_sessions", "Conversation sessions stored (SESSION_DB_PATH when set, else memory).", lambda: session_store.stats()["stored_sessions"])
+metrics.gauge("github_auto_sessions_in_memory", "Conversation sessions held in memory.", lambda: session_store.stats()["sessions"])
+metrics.gauge("github_auto_session_bytes", "Serialized checkpoint bytes held in memory, all sessions.", lambda: session_store.stats()["bytes_used"])
+metrics.gauge("github_auto_session_evictions", "Sessions dropped from memory to stay within SESSION_STORE_BYTES.", lambda: session_store.evictions)
+
+# Prometheus scrape endpoint
+@flask_app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+# Agent pool occupancy, for sizing AGENT_WORKERS / AGENT_QUEUE_DEPTH
+@flask_app.route('/pool_stats', methods=['GET'])
+def pool_stats():
+    with _runs_lock: retained = len(_runs)
+    return jsonify(dict(agent_pool.stats(), retained_runs=retained))
+
+# ASGI entry point (optional asgiref): `uvicorn app:asgi_app`. Runs execute on agent_pool either way.
+try:
+    from asgiref.wsgi import WsgiToAsgi
+    asgi_app = WsgiToAsgi(flask_app)
+except ImportError: asgi_app = None
+
+
+# === 7. Run Flask App ===
 if __name__ == '__main__':
-    if langgraph_agent_app and github_bot: # Check both agent and bot
-        print("Starting Flask application...")
-        flask_app.run(debug=True, host='0.0.0.0', port=5001)
-    else:
-        message = "Flask application will not start because "
-        if not langgraph_agent_app: message += "the LangGraph agent failed to compile. "
-        if not github_bot: message += "the GitHub connection failed. "
-        print(message)
+    # Components initialize lazily (and retry with backoff), so the server starts even if GitHub/Gemini are down; see /readyz.
+    logger.info("Starting Flask application...")
+    flask_app.run(debug=os.environ.get("FLASK_DEBUG") == "1", host='0.0.0.0', port=5001, threaded=True)
@@ -0,0 +1,591 @@
+""" Offline benchmark for the GitHub Auto agent: no Gemini quota, no GitHub rate limit.
+
+Runs representative prompts through the real Github_Auto, tools, LangGraph graph and Flask SSE endpoint,
+with two local stand-ins plugged in:
+  - FakeGithubStore: an in-memory GitHub (refs, commits, trees, blobs, contents API) seeded from this repo's
+    docs/ tree and base_template.md; records every request.
+  - ScriptedLLM: replays a fixed tool-call sequence per scenario and counts LLM steps and prompt tokens.
+
+Usage:
+    python benchmark.py                              # all scenarios, JSON report on stdout
+    python benchmark.py --iterations 20 --output bench.json
+    python benchmark.py --scenario read_test3 --github-latency-ms 50
+Behaviour checks (patch_github_file, anchored edits, compaction, streaming, ranged reads and outline, retry cap,
+rate pacing, git backend, ...) run first. A failed check, or a prompt that does not reach its expected outcome
+(commit made or not, no unexpected tool errors), makes the exit status 1.
+"boot" times a fresh interpreter importing bare Flask against one importing app (no warm-up), as a worker starts.
+Every scenario is reported twice: "cold" (fresh client, empty tree/blob/ETag/search-index caches) and "warm"
+(the same run repeated right after on that client).
+Diff two reports (e.g. between releases) with any JSON diff tool; keys are stable and sorted.
+"""
+import os
+import sys
+import json
+import time
+import base64
+import hashlib
+import argparse
+import statistics
+import threading
+import uuid
+import io
+import re
+import shutil
+import subprocess
+import tempfile
+from types import SimpleNamespace
+from typing import Dict, List, Optional
+
+# app.py reads its configuration at import; point it at fakes and keep import side effects quiet
+for key, value in {"GOOGLE_API_KEY": "benchmark", "GITHUB_TOKEN": "benchmark", "GITHUB_REPO_NAME": "benchmark/github_auto",
+                   "GITHUB_BRANCH": "main", "WARMUP_ON_START": "0", "LOG_LEVEL": "WARNING"}.items():
+    os.environ.setdefault(key, value)
+
+import app
+import requests
+from github.GithubException import GithubException, UnknownObjectException
+from langchain_core.messages import AIMessage, AIMessageChunk, HumanMessage, ToolMessage
+
+REPO_ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+# === 1. Fake GitHub ===
+def _git_sha(kind: str, payload: bytes) -> str:
+    """ Git-style object id, so identical content always gets the same SHA (warm caches survive a store reset). """
+    return hashlib.sha1(f"{kind} {len(payload)}\0".encode() + payload).hexdigest()
+
+
+class FakeGithubStore:
+    """ In-memory repository with a single branch. Every API call sleeps `latency` seconds and is recorded by endpoint. """
+    def __init__(self, seed_paths: List[str], branch: str = "main", latency: float = 0.0):
+        self.branch = branch; self.latency = latency
+        self.seed = {}
+        for rel in seed_paths:
+            with open(os.path.join(REPO_ROOT, rel), "rb") as f: self.seed[rel] = f.read()
+        self.requests: List[str] = []; self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        """ Back to the seeded state; SHAs are deterministic, so the client's caches stay valid for unchanged files. """
+        with self._lock:
+            self.blobs: Dict[str, bytes] = {}; self.trees: Dict[str, Dict[str, str]] = {}; self.commits: Dict[str, dict] = {}
+            files = {path: self._put_blob(data) for path, data in self.seed.items()}
+            self.head = self._put_commit("Initial seed", self._put_tree(files), [])
+            self.requests = []
+
+    def _put_blob(self, data: bytes) -> str:
+        sha = _git_sha("blob", data); self.blobs[sha] = data; return sha
+
+    def _put_tree(self, files: Dict[str, str]) -> str:
+        sha = _git_sha("tree", json.dumps(sorted(files.items())).encode()); self.trees[sha] = dict(files); return sha
+
+    def _put_commit(self, message: str, tree_sha: str, parents: List[str]) -> str:
+        sha = _git_sha("commit", json.dumps([message, tree_sha, parents]).encode())
+        self.commits[sha] = {"tree": tree_sha, "parents": parents, "message": message}; return sha
+
+    def record(self, endpoint: str) -> None:
+        if self.latency: time.sleep(self.latency)
+        with self._lock: self.requests.append(endpoint)
+
+    def snapshot(self) -> int:
+        with self._lock: return len(self.requests)
+
+    def calls_since(self, mark: int) -> List[str]:
+        with self._lock: return self.requests[mark:]
+
+    def files(self, commit_sha: Optional[str] = None) -> Dict[str, str]:
+        return self.trees[self.commits[commit_sha or self.head]["tree"]]
+
+
+class FakeRequester:
+    """ Stands in for PyGithub's Requester; only the conditional ref lookup goes through it. """
+    def __init__(self, store: FakeGithubStore): self.store = store
+
+    def requestJsonAndCheck(self, verb: str, url: str, headers: Optional[dict] = None):
+        if not url.endswith(f"/git/ref/heads/{self.store.branch}"): raise GithubException(404, {"message": f"Fake: unsupported {verb} {url}"}, None)
+        etag = f'"{self.store.head}"'
+        if headers and headers.get("If-None-Match") == etag: self.store.record("git_ref:304"); return {"etag": etag}, None
+        self.store.record("git_ref"); return {"etag": etag}, {"ref": f"refs/heads/{self.store.branch}", "object": {"sha": self.store.head, "type": "commit"}}
+
+
+class FakeRef:
+    def __init__(self, store: FakeGithubStore): self.store = store; self.object = SimpleNamespace(sha=store.head)
+
+    def edit(self, sha: str, force: bool = False) -> None:
+        self.store.record("update_ref")
+        with self.store._lock:
+            if not force and self.store.head not in self.store.commits[sha]["parents"]: raise GithubException(422, {"message": "Update is not a fast forward"}, None)
+            self.store.head = sha
+
+
+class FakeRepository:
+    """ The subset of PyGithub's Repository that Github_Auto uses. """
+    def __init__(self, store: FakeGithubStore, full_name: str):
+        self.store = store; self.full_name = full_name
+        self.url = f"https://api.github.invalid/repos/{full_name}"; self._requester = FakeRequester(store)
+
+    def get_branch(self, branch: str):
+        self.store.record("branch")
+        if branch != self.store.branch: raise UnknownObjectException(404, {"message": "Branch not found"}, None)
+        return SimpleNamespace(name=branch, commit=SimpleNamespace(sha=self.store.head))
+
+    def get_git_ref(self, ref: str):
+        self.store.record("git_ref"); return FakeRef(self.store)
+
+    def get_git_commit(self, sha: str):
+        self.store.record("git_commit"); commit = self.store.commits[sha]
+        return SimpleNamespace(sha=sha, tree=SimpleNamespace(sha=commit["tree"]), parents=[SimpleNamespace(sha=p) for p in commit["parents"]])
+
+    def get_git_tree(self, sha: str, recursive: bool = False):
+        self.store.record("git_tree"); files = self.store.trees[sha]
+        entries = [SimpleNamespace(path=path, type="blob", size=len(self.store.blobs[blob]), sha=blob, mode="100644") for path, blob in sorted(files.items())]
+        return SimpleNamespace(sha=sha, tree=entries, raw_data={"sha": sha, "truncated": False})
+
+    def get_git_blob(self, sha: str):
+        self.store.record("git_blob"); data = self.store.blobs[sha]
+        return SimpleNamespace(sha=sha, size=len(data), encoding="base64", content=base64.b64encode(data).decode())
+
+    def get_contents(self, path: str, ref: Optional[str] = None):
+        self.store.record("contents"); files = self.store.files(); path = path.strip("/")
+        if path in files:
+            data = self.store.blobs[files[path]]
+            return SimpleNamespace(path=path, type="file", sha=files[path], size=len(data), content=base64.b64encode(data).decode())
+        children = sorted({p[len(path) + 1:].split("/")[0] for p in files if p.startswith(path + "/")}) if path else sorted({p.split("/")[0] for p in files})
+        if not children: raise UnknownObjectException(404, {"message": "Not Found"}, None)
+        prefix = f"{path}/" if path else ""
+        return [SimpleNamespace(path=prefix + name, type="file" if prefix + name in files else "dir") for name in children]
+
+    def _commit_files(self, message: str, changes: Dict[str, str]) -> tuple:
+        with self.store._lock:
+            parent = self.store.head; files = dict(self.store.files(parent)); files.update(changes)
+            sha = self.store._put_commit(message, self.store._put_tree(files), [parent]); self.store.head = sha
+        return sha, parent
+
+    def _file_response(self, path: str, content: str, message: str) -> dict:
+        blob_sha = self.store._put_blob(content.encode("utf-8"))
+        commit_sha, parent = self._commit_files(message, {path: blob_sha})
+        return {"commit": SimpleNamespace(sha=commit_sha, parents=[SimpleNamespace(sha=parent)]), "content": SimpleNamespace(sha=blob_sha, path=path)}
+
+    def create_file(self, path: str, message: str, content: str, branch: Optional[str] = None):
+        self.store.record("contents_create")
+        if path in self.store.files(): raise GithubException(422, {"message": "sha wasn't supplied"}, None)
+        return self._file_response(path, content, message)
+
+    def update_file(self, path: str, message: str, content: str, sha: str, branch: Optional[str] = None):
+        self.store.record("contents_update")
+        if self.store.files().get(path) != sha: raise GithubException(409, {"message": f"{path} does not match {sha}"}, None)
+        return self._file_response(path, content, message)
+
+    def create_git_blob(self, content: str, encoding: str):
+        self.store.record("create_blob"); return SimpleNamespace(sha=self.store._put_blob(content.encode("utf-8")))
+
+    def create_git_tree(self, tree: list, base_tree=None):
+        self.store.record("create_tree")
+        files = dict(self.store.trees[base_tree.sha]) if base_tree is not None else {}
+        for element in tree: identity = element._identity; files[identity["path"]] = identity["sha"]
+        return SimpleNamespace(sha=self.store._put_tree(files))
+
+    def create_git_commit(self, message: str, tree, parents: list):
+        self.store.record("create_commit")
+        return SimpleNamespace(sha=self.store._put_commit(message, tree.sha, [p.sha for p in parents]))
+
+
+class FakeRawAdapter(requests.adapters.BaseAdapter):
+    """ Serves the raw blob endpoint (`.../git/blobs/<sha>`) that GithubTransport.stream reads, from the store. """
+    def __init__(self, store: FakeGithubStore):
+        super().__init__(); self.store = store
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        self.store.record("git_blob_raw"); sha = request.url.rstrip("/").rsplit("/", 1)[-1]
+        response = requests.Response(); response.request = request; response.url = request.url
+        response.status_code = 200 if sha in self.store.blobs else 404
+        response.raw = io.BytesIO(self.store.blobs.get(sha, b"")); return response
+
+    def close(self) -> None: pass
+
+
+class FakeTransport(app.GithubTransport):
+    """ The real transport (scheduler, stats, conditional GETs, raw streaming) minus the network: the client is an in-memory fake. """
+    def __init__(self, store: FakeGithubStore, repo_name: str):
+        repository = FakeRepository(store, repo_name)
+        client = SimpleNamespace(get_user=lambda: SimpleNamespace(login="benchmark"), get_repo=lambda name: repository)
+        super().__init__("benchmark", rate_reserve=0, max_concurrency=app.GITHUB_CONCURRENCY, github=client)
+        self.session.mount(repository.url, FakeRawAdapter(store))
+
+
+# === 2. Scripted LLM ===
+class ScriptedLLM:
+    """ Replays one scripted AIMessage per agent step, chosen by the prompt and how many AI turns already happened.
+        A step is {"tool_calls": [(name, args), ...]} or {"text": "..."}. Records steps and estimated prompt tokens. """
+    def __init__(self, scripts: Dict[str, List[dict]], chunk_chars: int = 24):
+        self.scripts = scripts; self.chunk_chars = chunk_chars
+        self.steps = 0; self.prompt_tokens = 0; self._lock = threading.Lock()
+
+    def stream(self, messages):
+        turn = max(i for i, m in enumerate(messages) if isinstance(m, HumanMessage)) # Session runs carry earlier turns
+        prompt = messages[turn].content
+        step_index = sum(isinstance(m, AIMessage) for m in messages[turn:])
+        script = self.scripts[prompt]; step = script[min(step_index, len(script) - 1)]
+        with self._lock: self.steps += 1; self.prompt_tokens += sum(app.estimate_tokens(m) for m in messages)
+        if "tool_calls" in step:
+            chunks = [{"name": name, "args": json.dumps(args), "id": f"call_{step_index}_{i}_{threading.get_ident()}", "index": i} for i, (name, args) in enumerate(step["tool_calls"])]
+            yield AIMessageChunk(content="", tool_call_chunks=chunks); return
+        text = step["text"]
+        for start in range(0, len(text), self.chunk_chars): yield AIMessageChunk(content=text[start:start + self.chunk_chars])
+
+    def reset_counters(self) -> None:
+        with self._lock: self.steps = 0; self.prompt_tokens = 0
+
+
+# === 3. Scenarios ===
+def _read(rel: str) -> str:
+    with open(os.path.join(REPO_ROOT, rel), encoding="utf-8") as f: return f.read()
+
+def build_scripts() -> Dict[str, List[dict]]:
+    template = _read(app.BASE_TEMPLATE_PATH)
+    jojoba = template.replace("[Ingredient Name]", "Jojoba Oil").replace("[Brief introduction about the ingredient: origin, traditional uses, and general benefits.]",
+                                                                           "Jojoba oil is a liquid wax ester from the seeds of *Simmondsia chinensis*.")
+    return {
+        "read test3": [
+            {"tool_calls": [("read_github_file", {"file_path": "docs/test3.md"})]}, # Wrong first guess
+            {"tool_calls": [("search_github_files", {"query": "test3"})]},
+            {"tool_calls": [("read_github_file", {"file_path": "docs/ingredients/test3.md"})]},
+            {"text": "Here is docs/ingredients/test3.md: " + _read("docs/ingredients/test3.md")[:200]},
+        ],
+        "create an ingredient file for jojoba oil": [
+            {"tool_calls": [("read_github_file", {"file_path": app.BASE_TEMPLATE_PATH})]},
+            {"tool_calls": [("write_github_file", {"file_path": "docs/ingredients/jojoba_oil.md", "content": jojoba, "commit_message": "feat: Add jojoba_oil.md"})]},
+            {"text": "Created docs/ingredients/jojoba_oil.md from the base template."},
+        ],
+        "update the argan oil overview, cost and lightweight notes": [
+            {"tool_calls": [("read_github_file", {"file_path": "docs/ingredients/argan_oil.md"})]},
+            {"tool_calls": [("patch_github_file", {"file_path": "docs/ingredients/argan_oil.md", "commit_message": "docs: Update argan_oil.md", "edits": [
+                {"op": "replace", "anchor": "Argan oil is extracted from the kernels", "content": "Argan oil is cold-pressed from the kernels of the *Argania spinosa* tree (Morocco)."},
+                {"op": "replace", "anchor": "High-quality argan oil can be expensive.", "content": "  High-quality argan oil can be expensive; blends are common."},
+                {"op": "insert_after", "anchor": "Absorbs quickly without leaving a greasy residue.", "content": "  Works as a leave-in on damp hair."},
+            ]})]},
+            {"text": "Updated three sections of docs/ingredients/argan_oil.md in one commit."},
+        ],
+        "add a use case to it": [ # Follow-up turn: the path is already known from the session, no search or listing
+            {"tool_calls": [("patch_github_file", {"file_path": "docs/ingredients/test3.md", "commit_message": "docs: Add test3 use case", "edits": [
+                {"op": "insert_after", "anchor": "## Use Cases / Effects", "content": "Smoothing serums."},
+            ]})]},
+            {"text": "Added a use case to docs/ingredients/test3.md."},
+        ],
+    }
+
+# Per prompt: whether the run must end in a commit, and how many tool errors its script provokes on purpose
+EXPECTED_OUTCOMES = {
+    "read test3": {"commit": False, "tool_errors": 1}, # The wrong first guess
+    "create an ingredient file for jojoba oil": {"commit": True, "tool_errors": 0},
+    "update the argan oil overview, cost and lightweight notes": {"commit": True, "tool_errors": 0},
+    "add a use case to it": {"commit": True, "tool_errors": 0},
+}
+
+SCENARIOS = {
+    "read_test3": {"prompt": "read test3", "clients": 1},
+    "create_ingredient": {"prompt": "create an ingredient file for jojoba oil", "clients": 1},
+    "multi_line_update": {"prompt": "update the argan oil overview, cost and lightweight notes", "clients": 1},
+    "concurrent_sse_clients": {"prompt": "read test3", "clients": 8},
+    "session_follow_up": {"prompt": "read test3", "follow_up": "add a use case to it", "clients": 1},
+}
+
+
+# === 4. Behaviour Checks ===
+# Run before the timings: a tool that always errors must fail the benchmark, not just look fast.
+def _check(condition: bool, message: str) -> None:
+    if not condition: raise AssertionError(message)
+
+def check_apply_edits() -> None:
+    content = "# T\r\nalpha\r\nbeta\r\ngamma\r\n"
+    edits = [{"op": "replace", "anchor": "alpha", "content": "ALPHA"}, {"op": "insert_after", "anchor": "gamma", "content": "delta"},
+             {"op": "delete", "anchor": "beta"}]
+    new_content, report, all_ok = app.Github_Auto._apply_edits(content, edits)
+    _check(all_ok and new_content == "# T\r\nALPHA\r\ngamma\r\ndelta\r\n", f"_apply_edits produced {new_content!r}: {report}")
+    new_content, report, all_ok = app.Github_Auto._apply_edits(content, [{"op": "replace", "anchor": "missing", "content": "x"}])
+    _check(not all_ok and new_content == content, f"_apply_edits accepted a missing anchor: {report}")
+    mixed = "a\x0cb\nc\r\nd" # Form feed is not a line break; each line keeps its own ending
+    new_content, report, _ = app.Github_Auto._apply_edits(mixed, [{"op": "replace", "anchor": "c", "content": "C"}])
+    _check(new_content == "a\x0cb\nC\r\nd", f"_apply_edits rewrote line endings: {new_content!r}")
+    new_content, report, _ = app.Github_Auto._apply_edits("x\ny\nz\n", [{"op": "replace", "anchor": "y", "content": "", "occurrence": 1}])
+    _check(new_content == "x\n\nz\n", f"replace with empty content must leave an empty line (update_file_section): {new_content!r}")
+
+def check_patch_tool(store: FakeGithubStore) -> None:
+    """ Calls patch_github_file the way the agent does (tool-argument validation included) and reads the result back. """
+    store.reset(); path = "docs/ingredients/argan_oil.md"; head = store.head
+    result = app.patch_github_file.invoke({"file_path": path, "commit_message": "check: patch", "edits": [
+        {"op": "insert_after", "anchor": "## Overview", "content": "Benchmark check line."}]})
+    _check(result.startswith("Success"), f"patch_github_file failed: {result[:300]}")
+    _check(store.head != head, "patch_github_file reported success but no commit was made")
+    _check("## Overview\nBenchmark check line." in store.blobs[store.files()[path]].decode("utf-8"), "patched content not found in the new commit")
+    store.reset()
+
+def check_compaction() -> None:
+    """ Recent tool results that alone exceed the budget must be cut, not sent verbatim. """
+    messages = [HumanMessage(content="read them")]
+    for n in range(4):
+        messages += [AIMessage(content="", tool_calls=[{"name": "read_github_file", "args": {"file_path": f"docs/{n}.md"}, "id": f"c{n}"}]),
+                     ToolMessage(content="x" * 20000, tool_call_id=f"c{n}")]
+    compacted = app.compact_messages(messages, 4000, 4)
+    total = sum(app.estimate_tokens(m) for m in compacted)
+    _check(total <= 4000, f"compaction left {total} tokens for a 4000-token budget")
+    _check(all(m.content.startswith("x") for m in compacted if isinstance(m, ToolMessage)), "recent results were stubbed instead of cut")
+
+def check_stream_blob(store: FakeGithubStore) -> None:
+    """ Large-blob reads go through GithubTransport.stream; it must work on the fake transport and stop early when asked. """
+    sha = store.files()["docs/ingredients/argan_oil.md"]; full = store.blobs[sha]
+    body, complete = app.github_component.peek()._stream_blob(sha)
+    _check(complete and body == full, "streamed blob differs from the stored one")
+    body, complete = app.github_component.peek()._stream_blob(sha, stop_lines=1)
+    _check(body.startswith(full.split(b"\n", 1)[0]) and (not complete or len(full) <= len(body)), "stop_lines did not stop the stream")
+
+def check_rate_pacing() -> None:
+    """ No pacing with a healthy budget; pacing near the reserve; 304s (free on GitHub) do not use up a token. """
+    requester = SimpleNamespace(rate_limiting=(4900, 5000), rate_limiting_resettime=time.time() + 3600,
+                                requestJsonAndCheck=lambda method, url, headers=None: ({"etag": "e1"}, None if headers else {"sha": "x"}))
+    transport = app.GithubTransport("x", rate_reserve=100, pace_below=1000, github=SimpleNamespace(requester=requester))
+    started = time.perf_counter()
+    for _ in range(50): transport.call("noop", lambda: None)
+    _check(time.perf_counter() - started < 1.0, f"50 calls with 4900 requests left took {time.perf_counter() - started:.1f}s")
+    requester.rate_limiting = (150, 5000)
+    _check(transport._refill_rate() is not None, "no pacing with 150 requests left")
+    transport.conditional_get("ref", requester, "u"); tokens = transport._tokens
+    for _ in range(20): transport.conditional_get("ref", requester, "u") # All 304s
+    _check(transport._tokens >= tokens, f"304s used up tokens: {tokens:.2f} -> {transport._tokens:.2f}")
+
+def check_read_range(store: FakeGithubStore) -> None:
+    """ Line, byte and heading slices, the outline, out-of-range starts, and an open-ended byte read of a blob over the limit. """
+    bot = app.github_component.peek(); path = "docs/ingredients/argan_oil.md"; full = store.blobs[store.files()[path]].decode("utf-8")
+    total = len(full.splitlines())
+    result = bot.read_file_range(path, 2, 3)
+    _check(result == f"[{path} lines 2-3 of {total}]\n" + "\n".join(full.splitlines()[1:3]), f"line range: {result[:200]!r}")
+    result = bot.read_file_range(path, 0, 9, unit="bytes"); _check(result.endswith("\n# Argan O"), f"byte range: {result[:200]!r}")
+    result = bot.read_file_range(path, heading="overview")
+    _check(result.startswith(f"[{path} section 'Overview', lines 3-") and "\n## Overview\n" in result and "## Chemical" not in result, f"heading: {result[:200]!r}")
+    outline = bot.get_file_outline(path)
+    _check(outline.get("lines") == total and any(h["title"] == "Overview" and h["level"] == 2 for h in outline.get("headings", [])), f"outline: {outline}")
+    for args in ((total + 5, None), (len(full.encode("utf-8")) + 5, None, "bytes")):
+        result = bot.read_file_range(path, *args); _check(result.startswith("ERR range:"), f"start past EOF not refused: {result[:200]!r}")
+    _check(bot.read_file_range(path, heading="No Such Heading").startswith("ERR range:"), "missing heading not refused")
+    # A blob over the read limit: an open-ended byte read streams just its start instead of failing
+    big = app.Github_Auto(token="benchmark", repo_name=app.GITHUB_REPO_NAME, branch=store.branch, transport=FakeTransport(store, app.GITHUB_REPO_NAME), max_blob_bytes=400)
+    big.LARGE_BLOB_BYTES = 100
+    result = big.read_file_range(path, unit="bytes", max_chars=50)
+    _check(result.startswith(f"[{path} bytes 0-50]") and "# Argan Oil" in result, f"open-ended byte read over the limit: {result[:200]!r}")
+    _check(big.read_file_range(path, 40, 45).startswith(f"[{path} lines 40-45]"), "line range of a blob over the limit")
+
+def check_retry_cap() -> None:
+    """ The real client must build, and must not sleep longer than the cap for a rate-limit reset. """
+    retry = app.GithubTransport("x", max_rate_wait=7).session.get_adapter("https://api.github.com").max_retries
+    _check(getattr(retry, "max_rate_limit_wait", 7) == 7, f"rate-limit wait not capped: {retry!r}")
+
+def check_failed_commit_rollback(store: FakeGithubStore) -> None:
+    """ A session turn whose commit fails must leave the session checkpoint as it was before the turn. """
+    client = app.flask_app.test_client(); session_id = uuid.uuid4().hex; bot = app.github_component.peek()
+    _check(run_prompt(client, "read test3", session_id)["ok"], "first session turn failed")
+    before = app.session_store.snapshot(session_id)
+    bot.commit_session = lambda session: "ERR: Benchmark check: commit refused."
+    try: result = run_prompt(client, "add a use case to it", session_id)
+    finally: del bot.commit_session
+    _check(result["failure"] is not None and result["failure"].startswith("commit failed"), f"forced commit failure not reported: {result['failure']}")
+    after = app.session_store.snapshot(session_id)
+    _check(after is not None and after["checkpoint"] == before["checkpoint"], "failed commit left the turn in the session checkpoint")
+    app.session_store.delete_thread(session_id); store.reset()
+
+def check_resume_from_accepted(store: FakeGithubStore) -> None:
+    """ The 'accepted' event id alone must let a reconnecting client resume the run rather than start a new one. """
+    client = app.flask_app.test_client(); runs = len(app._runs)
+    body = client.get("/agent_stream", query_string={"prompt": "read test3"}).get_data().decode("utf-8")
+    first_id = next(line[4:] for line in body.splitlines() if line.startswith("id: "))
+    _check(first_id.endswith(":1") and '"type": "accepted"' in body.split("\n\n")[1], f"first event is not an id-carrying 'accepted': {body[:200]!r}")
+    resumed = _sse_events(client.get("/agent_stream", query_string={"prompt": "read test3"}, headers={"Last-Event-ID": first_id}).get_data())
+    _check(resumed and resumed[0].get("type") != "accepted" and resumed[-1].get("type") == "complete", f"resume did not replay the rest of the run: {resumed[:2]}")
+    _check(len(app._runs) == runs + 1, "resuming started another run")
+    store.reset()
+
+def check_index_load_deferred() -> None:
+    """ A persisted search index is read on first search, not when the index (and so app) is constructed. """
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "index.json")
+        with open(path, "w", encoding="utf-8") as f: json.dump({"head_sha": "0" * 40, "files": {"docs/a.md": "1" * 40}, "texts": {"docs/a.md": "# Alpha\n"}}, f)
+        index = app.RepoSearchIndex(path)
+        _check(not index.files, "persisted index was read at construction")
+        _check([hit["path"] for hit in index.search("alpha")] == ["docs/a.md"], "persisted index not loaded on first search")
+
+class CheckSkipped(Exception):
+    pass
+
+def _git(cwd: str, *args: str) -> str:
+    return subprocess.run(["git", "-c", "user.name=benchmark", "-c", "user.email=benchmark@localhost", *args], cwd=cwd, check=True,
+                          capture_output=True).stdout.decode("utf-8").strip()
+
+def check_git_backend() -> None:
+    """ LocalGitBackend against a temporary bare repo that a second clone moves meanwhile: a push over an unrelated remote
+        commit is rebased and lands; a session commit over a remote change to the same file is parked and reported as ERR,
+        while other unpushed commits are replayed and pushed. """
+    if shutil.which("git") is None: raise CheckSkipped("git not installed")
+    with tempfile.TemporaryDirectory() as tmp:
+        remote, other = os.path.join(tmp, "remote.git"), os.path.join(tmp, "other")
+        _git(tmp, "init", "-q", "--bare", remote); _git(tmp, "clone", "-q", remote, other)
+        with open(os.path.join(other, "a.md"), "w") as f: f.write("# A\n")
+        _git(other, "add", "a.md"); _git(other, "commit", "-qm", "init"); _git(other, "push", "-q", "origin", "HEAD:main")
+        def remote_commit(path: str, text: str) -> str:
+            with open(os.path.join(other, path), "w") as f: f.write(text)
+            _git(other, "add", path); _git(other, "commit", "-qm", f"remote: {path}"); _git(other, "push", "-q", "origin", "HEAD:main")
+            return _git(other, "rev-parse", "HEAD")
+        bot = app.LocalGitBackend(remote, os.path.join(tmp, "mirror"), branch="main", fetch_interval=3600, push_interval=0)
+        # Rebased push: the remote gained an unrelated commit after our mirror last fetched
+        result = bot.create_or_update_file("b.md", "# B\n", "local: b.md"); _check(result.startswith("Success"), f"local write failed: {result}")
+        moved = remote_commit("c.md", "# C\n")
+        result = bot.push(); head = _git(other, "ls-remote", remote, "refs/heads/main").split()[0]
+        _check(result.startswith("Pushed"), f"rebased push failed: {result}")
+        _check(_git(remote, "merge-base", "--is-ancestor", moved, head) == "" and _git(remote, "show", f"{head}:b.md") == "# B",
+               "pushed branch lost the remote commit or the local file")
+        # Conflict: a session changed a.md, which also changed remotely; an unrelated unpushed commit (another run's) still lands
+        _git(other, "pull", "-q", "origin", "main")
+        result = bot.create_or_update_file("d.md", "# D\n", "local: d.md"); _check(result.startswith("Success"), f"local write failed: {result}")
+        moved = remote_commit("a.md", "# A remote\n")
+        with bot.write_session() as session: bot.create_or_update_file("a.md", "# A local\n", "session: a.md")
+        result = bot.commit_session(session); parked = bot._out("for-each-ref", "--format=%(refname)", bot.CONFLICT_REF_PREFIX).split()
+        head = _git(other, "ls-remote", remote, "refs/heads/main").split()[0]
+        _check(result.startswith("ERR") and len(parked) == 1, f"conflicting session commit not reported or not parked alone: {result} {parked}")
+        _check(_git(remote, "show", f"{head}:d.md") == "# D" and _git(remote, "show", f"{head}:a.md") == "# A remote"
+               and _git(remote, "merge-base", "--is-ancestor", moved, head) == "", "non-conflicting commit was not replayed over the remote change")
+        _check(bot._rev("refs/heads/main") == head and bot.unpushed() == 0, "branch not at the pushed head after parking")
+        _check(bot._out("show", f"{parked[0]}:a.md") == "# A local", "parked ref does not hold the session's change")
+        _check(bot.get_file_content("a.md").strip().endswith("# A remote"), "reads after parking do not show the remote content")
+
+def run_checks(store: FakeGithubStore) -> Dict[str, str]:
+    results = {}
+    for name, check in (("apply_edits", check_apply_edits), ("patch_tool", lambda: check_patch_tool(store)), ("compaction", check_compaction),
+                        ("stream_blob", lambda: check_stream_blob(store)), ("read_range", lambda: check_read_range(store)), ("retry_cap", check_retry_cap), ("rate_pacing", check_rate_pacing), ("git_backend", check_git_backend),
+                        ("failed_commit_rollback", lambda: check_failed_commit_rollback(store)), ("resume_from_accepted", lambda: check_resume_from_accepted(store)),
+                        ("index_load_deferred", check_index_load_deferred)):
+        try: check(); results[name] = "ok"
+        except CheckSkipped as e: results[name] = f"skipped: {e}"
+        except Exception as e: results[name] = f"FAILED: {type(e).__name__}: {e}"
+    return results
+
+
+# === 5. Runner ===
+def _sse_events(body: bytes) -> List[dict]:
+    return [json.loads(line[6:]) for line in body.decode("utf-8").splitlines() if line.startswith("data: ")]
+
+# "Tool Result (<id> <tool> <ms>ms): <first 100 chars>" entries of the status events
+TOOL_ERROR = re.compile(r"Tool Result \([^)]*\): (?:ERR|Error)")
+
+def _failure(events: List[dict], expected: dict) -> Optional[str]:
+    """ Why a finished run does not count as a success for its prompt, or None. """
+    complete = next((e for e in events if e.get("type") == "complete"), None)
+    if not events or events[0].get("type") != "accepted": return "first event is not 'accepted'"
+    if complete is None: return "no complete event"
+    commit = complete.get("commit")
+    if commit and commit.startswith("ERR"): return f"commit failed: {commit[:200]}"
+    if expected["commit"] and not commit: return "expected a commit, none was made"
+    tool_errors = sum(len(TOOL_ERROR.findall(e.get("message", ""))) for e in events if e.get("type") == "status")
+    if tool_errors > expected["tool_errors"]: return f"{tool_errors} tool error(s), {expected['tool_errors']} expected"
+    return None
+
+def run_prompt(client, prompt: str, session_id: Optional[str] = None) -> dict:
+    """ One full /agent_stream request, read to the end as a browser would, and checked against the prompt's expected outcome. """
+    started = time.perf_counter()
+    response = client.get("/agent_stream", query_string=dict({"prompt": prompt}, **({"session_id": session_id} if session_id else {})))
+    events = _sse_events(response.get_data())
+    latency = time.perf_counter() - started
+    failure = _failure(events, EXPECTED_OUTCOMES[prompt])
+    first_token = next((i for i, e in enumerate(events) if e.get("type") == "token"), None)
+    return {"latency": latency, "ok": failure is None, "failure": failure, "status": response.status_code, "events": len(events),
+            "tokens_streamed": sum(e.get("type") == "token" for e in events), "first_token_event": first_token}
+
+def _percentiles(values: List[float]) -> dict:
+    ordered = sorted(values)
+    pick = lambda q: ordered[min(int(round(q * (len(ordered) - 1))), len(ordered) - 1)]
+    return {"p50": round(pick(0.5) * 1000, 2), "p90": round(pick(0.9) * 1000, 2), "p99": round(pick(0.99) * 1000, 2),
+            "mean": round(statistics.fmean(ordered) * 1000, 2), "max": round(ordered[-1] * 1000, 2)}
+
+def _phase_report(results: List[dict], calls: Dict[str, int], steps: int, prompt_tokens: int) -> dict:
+    prompts = len(results); total_calls = sum(calls.values()); reasons: Dict[str, int] = {}
+    for r in results:
+        if r["failure"]: reasons[r["failure"]] = reasons.get(r["failure"], 0) + 1
+    return {"prompts": prompts, "failures": sum(not r["ok"] for r in results), "failure_reasons": reasons,
+            "latency_ms": _percentiles([r["latency"] for r in results]),
+            "github_calls_per_prompt": round(total_calls / prompts, 2),
+            "github_calls_per_prompt_excluding_304": round(sum(v for k, v in calls.items() if not k.endswith(":304")) / prompts, 2),
+            "github_calls_by_endpoint": dict(sorted(calls.items())),
+            "llm_steps_per_prompt": round(steps / prompts, 2), "prompt_tokens_per_prompt": round(prompt_tokens / prompts, 1)}
+
+def run_scenario(name: str, spec: dict, store: FakeGithubStore, llm: ScriptedLLM, iterations: int) -> dict:
+    """ Each iteration runs the scenario twice: "cold" on a fresh client (no tree, blob, ETag or search-index caches),
+        then "warm" right after on the same client, as the next user of a running server would. """
+    client = app.flask_app.test_client()
+    phases = {phase: {"results": [], "calls": {}, "steps": 0, "prompt_tokens": 0} for phase in ("cold", "warm")}
+    for _ in range(iterations):
+        fresh_backend(store)
+        for phase in ("cold", "warm"):
+            store.reset(); mark = store.snapshot(); llm.reset_counters()
+            results: List[dict] = []
+            def client_turns():
+                if "follow_up" not in spec: results.append(run_prompt(client, spec["prompt"])); return
+                session_id = uuid.uuid4().hex # Both turns share one checkpointed session
+                results.append(run_prompt(client, spec["prompt"], session_id)); results.append(run_prompt(client, spec["follow_up"], session_id))
+            threads = [threading.Thread(target=client_turns) for _ in range(spec["clients"])]
+            for t in threads: t.start()
+            for t in threads: t.join()
+            acc = phases[phase]; acc["results"].extend(results); acc["steps"] += llm.steps; acc["prompt_tokens"] += llm.prompt_tokens
+            for endpoint in store.calls_since(mark): acc["calls"][endpoint] = acc["calls"].get(endpoint, 0) + 1
+    report = {phase: _phase_report(**acc) for phase, acc in phases.items()}
+    return {"prompt": " / ".join(filter(None, (spec["prompt"], spec.get("follow_up")))), "clients": spec["clients"], "iterations": iterations,
+            "failures": sum(r["failures"] for r in report.values()), **report}
+
+def measure_boot(runs: int) -> dict:
+    """ Wall-clock time of a fresh interpreter importing bare Flask vs importing app (WARMUP_ON_START=0), median of `runs`. """
+    def median_ms(statement: str) -> float:
+        times = []
+        for _ in range(runs):
+            start = time.perf_counter(); subprocess.run([sys.executable, "-W", "ignore", "-c", statement], cwd=REPO_ROOT, env=os.environ, check=True, capture_output=True)
+            times.append(time.perf_counter() - start)
+        return round(statistics.median(times) * 1000, 1)
+    interpreter, flask, worker = median_ms("pass"), median_ms("import flask"), median_ms("import app")
+    return {"runs": runs, "interpreter_ms": interpreter, "import_flask_ms": flask, "import_app_ms": worker,
+            "app_over_flask_ms": round(worker - flask, 1), "app_over_flask_ratio": round((worker - interpreter) / max(flask - interpreter, 1e-3), 2)}
+
+def fresh_backend(store: FakeGithubStore) -> None:
+    """ A new Github_Auto (empty tree, content and ETag caches) and search index behind the app, so the next prompt runs cold. """
+    app.github_component.value = app.Github_Auto(token="benchmark", repo_name=app.GITHUB_REPO_NAME, branch=store.branch, content_cache_bytes=app.CONTENT_CACHE_BYTES,
+                                                 transport=FakeTransport(store, app.GITHUB_REPO_NAME))
+    app.search_index = app.RepoSearchIndex()
+
+def install_fakes(store: FakeGithubStore, llm: ScriptedLLM) -> None:
+    """ Puts the fakes behind the app's lazy components, exactly where the real GitHub client and Gemini would be. """
+    fresh_backend(store); app.github_component.state = "ready"
+    app.llm_component.value = llm; app.llm_component.state = "ready"
+    app.agent_component.get(); app.session_agent_component.get()
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Offline benchmark with fake GitHub and scripted LLM back ends.")
+    parser.add_argument("--iterations", type=int, default=10, help="Repetitions per scenario (default 10).")
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS), help="Run only these scenarios (repeatable).")
+    parser.add_argument("--github-latency-ms", type=float, default=20.0, help="Simulated latency per GitHub request (default 20).")
+    parser.add_argument("--boot-runs", type=int, default=5, help="Fresh interpreters timed for the boot report; 0 skips it (default 5).")
+    parser.add_argument("--output", help="Write the JSON report here instead of stdout.")
+    args = parser.parse_args(argv)
+
+    seed = [app.BASE_TEMPLATE_PATH] + sorted(os.path.relpath(os.path.join(root, f), REPO_ROOT).replace(os.sep, "/")
+                                            for root, _, files in os.walk(os.path.join(REPO_ROOT, "docs")) for f in files)
+    store = FakeGithubStore(seed, latency=args.github_latency_ms / 1000); llm = ScriptedLLM(build_scripts())
+    install_fakes(store, llm)
+    report = {"config": {"iterations": args.iterations, "github_latency_ms": args.github_latency_ms, "seed_files": len(seed),
+                         "tool_pool_size": app.TOOL_POOL_SIZE, "agent_workers": app.AGENT_WORKERS},
+              "boot": measure_boot(args.boot_runs) if args.boot_runs else "skipped",
+              "checks": run_checks(store),
+              "scenarios": {name: run_scenario(name, SCENARIOS[name], store, llm, args.iterations) for name in (args.scenario or SCENARIOS)}}
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f: f.write(output + "\n")
+    else: print(output)
+    failed_checks = any(result.startswith("FAILED") for result in report["checks"].values())
+    return 1 if failed_checks or any(s["failures"] for s in report["scenarios"].values()) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())